@@ -1,7 +1,11 @@
+import array
 import enum
 import os
+import re
 import struct
 import typing
+import weakref
+import zlib
 
 PATH_HASH_TABLE = (
     (0x00000000, 0x77073096, 0xEE0E612C, 0x990951BA, 0x076DC419, 0x706AF48F, 0xE963A535, 0x9E6495A3, 0x0EDB8832,
@@ -177,66 +181,120 @@ class GameInstallationRegion(enum.Enum):
     SouthKorea = "SouthKorea"
 
 
-def calculate_path_hash(path: typing.Union[bytes, str, os.PathLike]) -> int:
+def _normalize_path_for_hash(path: typing.Union[bytes, str, os.PathLike]) -> bytes:
     if isinstance(path, str):
         path = path.encode("utf-8")
     elif not isinstance(path, bytes):
         path = str(path).encode("utf-8")
+    return path.replace(b"\\", b"/").lower()
 
-    path = path.replace(b"\\", b"/").lower()
-    result = 0xFFFFFFFF
 
-    i = 0
-    while i < len(path) // 4 * 4:
-        result ^= int.from_bytes(path[i:i + 4], "little", signed=False)
-        result = (PATH_HASH_TABLE[3][0xFF & (result >> 0)] ^
-                  PATH_HASH_TABLE[2][0xFF & (result >> 8)] ^
-                  PATH_HASH_TABLE[1][0xFF & (result >> 16)] ^
-                  PATH_HASH_TABLE[0][0xFF & (result >> 24)])
-        i += 4
+def calculate_path_hash(path: typing.Union[bytes, str, os.PathLike]) -> int:
+    # PATH_HASH_TABLE is the standard CRC-32 table; the game does not apply the final xor.
+    return zlib.crc32(_normalize_path_for_hash(path)) ^ 0xFFFFFFFF
+
+
+def _calculate_split_path_hashes(path: bytes) -> typing.Tuple[int, int, int]:
+    # path must be normalized. The full path hash continues the CRC of the directory part, so every byte is hashed at
+    # most twice.
+    separator = path.rfind(b"/")
+    if separator == -1:
+        name_crc = zlib.crc32(path)
+        return 0xFFFFFFFF, name_crc ^ 0xFFFFFFFF, name_crc ^ 0xFFFFFFFF
+    path_crc = zlib.crc32(path[:separator])
+    name = path[separator + 1:]
+    return (path_crc ^ 0xFFFFFFFF,
+            zlib.crc32(name) ^ 0xFFFFFFFF,
+            zlib.crc32(name, zlib.crc32(b"/", path_crc)) ^ 0xFFFFFFFF)
+
+
+def calculate_path_hashes(paths: typing.Iterable[typing.Union[bytes, str, os.PathLike]]
+                          ) -> typing.Tuple[array.array, array.array, array.array]:
+    # Returns arrays of path hashes, name hashes, and full path hashes, in the order of paths.
+    path_hashes = array.array("I")
+    name_hashes = array.array("I")
+    full_path_hashes = array.array("I")
+    for path in paths:
+        path_hash, name_hash, full_path_hash = _calculate_split_path_hashes(_normalize_path_for_hash(path))
+        path_hashes.append(path_hash)
+        name_hashes.append(name_hash)
+        full_path_hashes.append(full_path_hash)
+    return path_hashes, name_hashes, full_path_hashes
+
+
+# Matches paths that os.path.normpath would change, other than by removing a trailing slash.
+_PATH_NEEDS_NORMPATH = re.compile(r"\\|//|(?:^|/)\.\.?(?:/|$)")
+
+
+def _normalize_full_path(full_path: typing.Union[str, bytes, os.PathLike]) -> str:
+    full_path = os.fspath(full_path)
+    if isinstance(full_path, bytes):
+        full_path = full_path.decode("utf-8")
+    is_directory = full_path.endswith(("/", "\\"))
+    if full_path and not _PATH_NEEDS_NORMPATH.search(full_path):
+        full_path = full_path.rstrip("/")
+    else:
+        full_path = os.path.normpath(full_path).replace("\\", "/")
+    if is_directory:
+        full_path += "/"
+    return full_path
+
+
+def _restore_path_spec(full_path: typing.Optional[str], path_hash: typing.Optional[int],
+                       name_hash: typing.Optional[int], full_path_hash: typing.Optional[int]) -> 'SqPathSpec':
+    if full_path is not None:
+        return SqPathSpec(full_path)
+    return SqPathSpec(path_hash=path_hash, name_hash=name_hash, full_path_hash=full_path_hash)
 
-    for i in range(i, len(path)):
-        result = PATH_HASH_TABLE[0][(result ^ path[i]) & 0xFF] ^ (result >> 8)
 
-    return result
+class SqPathSpec:
+    # Immutable. Hashes of full paths are resolved on construction; equality, ordering and hashing only look at the
+    # known hashes, so specs of the same path in different letter cases are equal, while a spec with a full path and
+    # one with only hashes are not (use matches for that).
+    # Before specs were hashable, == was what matches is now. That comparison cannot back __hash__: a full path spec
+    # would have to hash equal both to a spec with only its path and name hashes and to one with only its full path
+    # hash, which share no field. Code comparing specs of different kinds should call matches instead.
+    __slots__ = ("_full_path", "_path_hash", "_name_hash", "_full_path_hash", "__weakref__")
 
+    _interned: typing.ClassVar['weakref.WeakValueDictionary[tuple, SqPathSpec]'] = weakref.WeakValueDictionary()
 
-class SqPathSpec:
-    _full_path: typing.Optional[str] = None
-    _path_hash: typing.Optional[int] = None
-    _name_hash: typing.Optional[int] = None
-    _full_path_hash: typing.Optional[int] = None
+    _full_path: typing.Optional[str]
+    _path_hash: typing.Optional[int]
+    _name_hash: typing.Optional[int]
+    _full_path_hash: typing.Optional[int]
 
     def __new__(cls, full_path: typing.Union[str, bytes, os.PathLike, 'SqPathSpec', None] = None, *,
                 path_hash: typing.Optional[int] = None,
                 name_hash: typing.Optional[int] = None,
                 full_path_hash: typing.Optional[int] = None):
         if isinstance(full_path, SqPathSpec):
-            self = full_path
-        else:
-            self = super().__new__(cls)
-            if full_path is not None:
-                self._full_path = os.path.normpath(full_path).replace("\\", "/")
-                if full_path[-1] in ('/', '\\'):
-                    self._full_path += "/"
-            else:
-                self._path_hash = path_hash
-                self._name_hash = name_hash
-                self._full_path_hash = full_path_hash
+            return full_path
+
+        self = super().__new__(cls)
+        if full_path is not None:
+            full_path = _normalize_full_path(full_path)
+            path_hash, name_hash, full_path_hash = _calculate_split_path_hashes(_normalize_path_for_hash(full_path))
+        object.__setattr__(self, "_full_path", full_path)
+        object.__setattr__(self, "_path_hash", path_hash)
+        object.__setattr__(self, "_name_hash", name_hash)
+        object.__setattr__(self, "_full_path_hash", full_path_hash)
         return self
 
-    def _resolve_hashes_from_full_path(self):
-        if self._full_path_hash is not None and self._path_hash is not None and self._name_hash is not None:
-            return
-        if self._full_path is None:
-            return
-        *path, name = self._full_path.rsplit("/", 1)
-        self._path_hash = calculate_path_hash(path[0] if path else "")
-        self._name_hash = calculate_path_hash(name)
-        self._full_path_hash = calculate_path_hash(self._full_path)
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, item):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return _restore_path_spec, (self._full_path, self._path_hash, self._name_hash, self._full_path_hash)
+
+    def intern(self) -> 'SqPathSpec':
+        # Returns the one living SqPathSpec with the same full path and hashes, so that repeated paths share an object.
+        return SqPathSpec._interned.setdefault(
+            (self._full_path, self._path_hash, self._name_hash, self._full_path_hash), self)
 
     def __str__(self):
-        self._resolve_hashes_from_full_path()
         if self._full_path is not None:
             return self._full_path
         if self._path_hash is not None and self._name_hash is not None:
@@ -245,28 +303,25 @@ class SqPathSpec:
             return f"~{self._full_path_hash:08x}"
         return f"(empty path spec)"
 
+    def __repr__(self):
+        return f"{type(self).__name__}({str(self)!r})"
+
     @property
     def name_hash(self) -> int:
         if self._name_hash is None:
-            self._resolve_hashes_from_full_path()
-            if self._name_hash is None:
-                raise KeyError("name hash unknown")
+            raise KeyError("name hash unknown")
         return self._name_hash
 
     @property
     def path_hash(self) -> int:
         if self._path_hash is None:
-            self._resolve_hashes_from_full_path()
-            if self._path_hash is None:
-                raise KeyError("path hash unknown")
+            raise KeyError("path hash unknown")
         return self._path_hash
 
     @property
     def full_path_hash(self) -> int:
         if self._full_path_hash is None:
-            self._resolve_hashes_from_full_path()
-            if self._full_path_hash is None:
-                raise KeyError("full path hash unknown")
+            raise KeyError("full path hash unknown")
         return self._full_path_hash
 
     @property
@@ -276,71 +331,67 @@ class SqPathSpec:
         return self._full_path
 
     def has_path_name_hash(self) -> bool:
-        self._resolve_hashes_from_full_path()
         return self._path_hash is not None and self._name_hash is not None
 
     def has_full_path_hash(self) -> bool:
-        self._resolve_hashes_from_full_path()
         return self._full_path_hash is not None
 
     def has_full_path(self) -> bool:
         return self._full_path is not None
 
-    def __lt__(self, other: 'SqPathSpec'):
-        self._resolve_hashes_from_full_path()
-        other._resolve_hashes_from_full_path()
-        if self._full_path_hash != other.full_path_hash:
-            return self._full_path_hash < other._full_path_hash
-        if self._path_hash != other.path_hash:
-            return self._path_hash < other.path_hash
-        if self._name_hash != other.name_hash:
-            return self._name_hash < other.name_hash
+    def matches(self, other: typing.Union['SqPathSpec', str, bytes, os.PathLike]) -> bool:
+        # True if either the full path hashes or the path and name hashes are known for both and are the same.
+        other = SqPathSpec(other)
+        if self._full_path_hash is not None and self._full_path_hash == other._full_path_hash:
+            return True
+        if (self._path_hash is not None and self._name_hash is not None
+                and self._path_hash == other._path_hash and self._name_hash == other._name_hash):
+            return True
         return False
 
+    @property
+    def _key(self) -> typing.Tuple[int, int, int]:
+        return (-1 if self._full_path_hash is None else self._full_path_hash,
+                -1 if self._path_hash is None else self._path_hash,
+                -1 if self._name_hash is None else self._name_hash)
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __lt__(self, other: 'SqPathSpec'):
+        if not isinstance(other, SqPathSpec):
+            return NotImplemented
+        return self._key < other._key
+
     def __le__(self, other: 'SqPathSpec'):
-        self._resolve_hashes_from_full_path()
-        other._resolve_hashes_from_full_path()
-        if self._full_path_hash != other.full_path_hash:
-            return self._full_path_hash <= other._full_path_hash
-        if self._path_hash != other.path_hash:
-            return self._path_hash <= other.path_hash
-        if self._name_hash != other.name_hash:
-            return self._name_hash <= other.name_hash
-        return False
+        if not isinstance(other, SqPathSpec):
+            return NotImplemented
+        return self._key <= other._key
 
     def __gt__(self, other: 'SqPathSpec'):
-        self._resolve_hashes_from_full_path()
-        other._resolve_hashes_from_full_path()
-        if self._full_path_hash != other.full_path_hash:
-            return self._full_path_hash > other._full_path_hash
-        if self._path_hash != other.path_hash:
-            return self._path_hash > other.path_hash
-        if self._name_hash != other.name_hash:
-            return self._name_hash > other.name_hash
-        return False
+        if not isinstance(other, SqPathSpec):
+            return NotImplemented
+        return self._key > other._key
 
     def __ge__(self, other: 'SqPathSpec'):
-        self._resolve_hashes_from_full_path()
-        other._resolve_hashes_from_full_path()
-        if self._full_path_hash != other.full_path_hash:
-            return self._full_path_hash >= other._full_path_hash
-        if self._path_hash != other.path_hash:
-            return self._path_hash >= other.path_hash
-        if self._name_hash != other.name_hash:
-            return self._name_hash >= other.name_hash
-        return False
+        if not isinstance(other, SqPathSpec):
+            return NotImplemented
+        return self._key >= other._key
 
     def __eq__(self, other: 'SqPathSpec'):
-        self._resolve_hashes_from_full_path()
-        other._resolve_hashes_from_full_path()
-        if self._full_path_hash == other.full_path_hash and other.full_path_hash is not None:
+        if self is other:
             return True
-        if self._name_hash == other.name_hash and self._path_hash == other.path_hash and self._name_hash is not None:
-            return True
-        return False
+        if not isinstance(other, SqPathSpec):
+            return NotImplemented
+        return (self._full_path_hash == other._full_path_hash
+                and self._path_hash == other._path_hash
+                and self._name_hash == other._name_hash)
 
     def __ne__(self, other: 'SqPathSpec'):
-        return not self.__eq__(other)
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
 
 
 class CorruptDataException(RuntimeError):
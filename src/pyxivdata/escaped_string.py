@@ -3,10 +3,22 @@ import ctypes
 import enum
 import functools
 import typing
-from xml.sax.saxutils import escape, quoteattr
 
 from pyxivdata.common import GameLanguage
 
+
+# xml.sax.saxutils imports urllib.request, http.client and email, which takes longer than importing everything else
+# GameResourceReader needs; it is only imported once XML representations are asked for.
+def escape(data: str) -> str:
+    from xml.sax.saxutils import escape
+    return escape(data)
+
+
+def quoteattr(data: str) -> str:
+    from xml.sax.saxutils import quoteattr
+    return quoteattr(data)
+
+
 if typing.TYPE_CHECKING:
     from pyxivdata.resource.excel.rowdef import ExdRow, CompletionRow, MapRow
     from pyxivdata.resource.excel.reader import ExcelReader
@@ -0,0 +1,150 @@
+import bisect
+import concurrent.futures
+import io
+import os
+import pathlib
+import typing
+
+from pyxivdata.common import SqPathSpec
+from pyxivdata.sqpack.entry_decoder import read_at
+from pyxivdata.sqpack.path_db import SqPathDatabase
+from pyxivdata.sqpack.reader import SqpackReader
+
+_T = typing.TypeVar("_T")
+
+# (offset, stored size, path spec) of an entry in a dat file.
+DatRangeEntry = typing.Tuple[int, int, SqPathSpec]
+
+
+class DatRange(typing.NamedTuple):
+    # Entries of one dat file starting in [start, end).
+    index_path: pathlib.Path
+    data_index: int
+    start: int
+    end: int
+
+    @property
+    def data_path(self) -> pathlib.Path:
+        return self.index_path.with_suffix(f".dat{self.data_index}")
+
+    @property
+    def name(self) -> str:
+        return f"{self.index_path.parent.name}.{self.index_path.name.split('.')[0]}.dat{self.data_index}.{self.start:x}"
+
+
+def split_dat_ranges(index_paths: typing.Iterable[pathlib.Path], span: int) -> typing.List[DatRange]:
+    # Ranges of the largest dat files come first, so that a slow tail of big ranges does not leave workers idle.
+    result = []
+    for index_path in index_paths:
+        data_index = 0
+        while True:
+            try:
+                data_size = index_path.with_suffix(f".dat{data_index}").stat().st_size
+            except FileNotFoundError:
+                break
+            for start in range(0, data_size, span):
+                result.append((data_size, DatRange(index_path, data_index, start, min(data_size, start + span))))
+            data_index += 1
+    result.sort(key=lambda x: x[0], reverse=True)
+    return [x[1] for x in result]
+
+
+# Per worker process state; ranges of the same sqpack landing in the same worker share its reader and entry lists.
+_worker_path_db: typing.Optional[SqPathDatabase] = None
+_worker_path_db_path: typing.Optional[pathlib.Path] = None
+_worker_readers: typing.Dict[pathlib.Path, SqpackReader] = {}
+_worker_entries: typing.Dict[typing.Tuple[pathlib.Path, int], typing.Tuple[typing.List[int],
+                                                                           typing.List[DatRangeEntry]]] = {}
+
+
+def get_dat_range_entries(dat_range: DatRange, cache_dir: typing.Optional[pathlib.Path] = None,
+                          path_db_path: typing.Optional[pathlib.Path] = None) -> typing.List[DatRangeEntry]:
+    # Sorted by offset. The index is read once per process and per sqpack, however many of its ranges are asked for.
+    global _worker_path_db, _worker_path_db_path
+
+    if path_db_path != _worker_path_db_path:
+        close_dat_range_state()
+        if path_db_path is not None:
+            _worker_path_db = SqPathDatabase(path_db_path)
+        _worker_path_db_path = path_db_path
+
+    key = dat_range.index_path, dat_range.data_index
+    if key not in _worker_entries:
+        reader = _worker_readers.get(dat_range.index_path)
+        if reader is None:
+            reader = _worker_readers[dat_range.index_path] = SqpackReader(dat_range.index_path, cache_dir=cache_dir,
+                                                                          path_db=_worker_path_db)
+
+        by_data_index: typing.Dict[int, typing.List[DatRangeEntry]] = {}
+        for entry in reader.iter_entries(read_types=False):
+            by_data_index.setdefault(entry.data_index, []).append((entry.offset, entry.stored_size, entry.path_spec))
+        for data_index, entries in by_data_index.items():
+            entries.sort(key=lambda x: x[0])
+            _worker_entries[dat_range.index_path, data_index] = [x[0] for x in entries], entries
+        _worker_entries.setdefault(key, ([], []))
+
+    offsets, entries = _worker_entries[key]
+    return entries[bisect.bisect_left(offsets, dat_range.start):bisect.bisect_left(offsets, dat_range.end)]
+
+
+def close_dat_range_state():
+    global _worker_path_db, _worker_path_db_path
+
+    for reader in _worker_readers.values():
+        reader.close()
+    _worker_readers.clear()
+    _worker_entries.clear()
+    if _worker_path_db is not None:
+        _worker_path_db.close()
+    _worker_path_db = _worker_path_db_path = None
+
+
+def iter_merged_reads(fp: typing.Union[typing.BinaryIO, io.RawIOBase], entries: typing.Sequence[DatRangeEntry],
+                      max_read_size: int) -> typing.Iterator[typing.Tuple[memoryview, typing.List[DatRangeEntry]]]:
+    # Runs of adjacent entries are read at once, up to max_read_size unless a single entry is larger.
+    # Yields the data read, starting at the offset of the first entry, along with the entries in it.
+    i = 0
+    while i < len(entries):
+        read_from, stored_size, _ = entries[i]
+        read_to = read_from + stored_size
+        j = i + 1
+        while (j < len(entries) and entries[j][0] <= read_to
+               and entries[j][0] + entries[j][1] - read_from <= max_read_size):
+            read_to = max(read_to, entries[j][0] + entries[j][1])
+            j += 1
+        yield memoryview(read_at(fp, read_from, read_to - read_from)), list(entries[i:j])
+        i = j
+
+
+def run_tasks(fn: typing.Callable[..., _T], tasks: typing.Sequence[typing.Tuple], max_workers: typing.Optional[int]
+              ) -> typing.Iterator[_T]:
+    # Calls fn(*task) for every task and yields results as they complete; max_workers=0 runs everything in this
+    # process, in order.
+    if max_workers == 0:
+        try:
+            for task in tasks:
+                yield fn(*task)
+        finally:
+            close_dat_range_state()
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        futures = [executor.submit(fn, *task) for task in tasks]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def write_file_atomic(path: pathlib.Path, data: typing.Union[bytes, bytearray, memoryview]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with temp_path.open("wb") as fp:
+            fp.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
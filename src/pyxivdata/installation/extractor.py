@@ -0,0 +1,181 @@
+import dataclasses
+import os
+import pathlib
+import time
+import typing
+
+from pyxivdata.common import SqPathSpec
+from pyxivdata.installation.dat_range import DatRange, split_dat_ranges, get_dat_range_entries, iter_merged_reads, \
+    run_tasks, write_file_atomic
+from pyxivdata.sqpack.entry_decoder import decode_entry_data
+from pyxivdata.sqpack.path_db import SqPathDatabase
+
+if typing.TYPE_CHECKING:
+    from pyxivdata.installation.resource_reader import GameResourceReader
+
+# Directory under the output directory for entries whose full path is unknown.
+UNKNOWN_PATH_DIRECTORY = "~unknown"
+
+# Directory under the output directory holding one manifest per task.
+MANIFEST_DIRECTORY = "~manifest"
+
+
+class ExtractTaskResult(typing.NamedTuple):
+    task: DatRange
+    entries: int
+    entries_skipped: int
+    bytes_read: int
+    bytes_written: int
+    errors: typing.List[typing.Tuple[str, str]]
+
+
+@dataclasses.dataclass
+class ExtractProgress:
+    tasks_done: int = 0
+    tasks_total: int = 0
+    entries: int = 0
+    entries_skipped: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    elapsed: float = 0.
+    errors: typing.List[typing.Tuple[str, str]] = dataclasses.field(default_factory=list)
+
+    @property
+    def read_mb_per_second(self) -> float:
+        return self.bytes_read / 1048576 / self.elapsed if self.elapsed else 0.
+
+    @property
+    def written_mb_per_second(self) -> float:
+        return self.bytes_written / 1048576 / self.elapsed if self.elapsed else 0.
+
+    @property
+    def entries_per_second(self) -> float:
+        return self.entries / self.elapsed if self.elapsed else 0.
+
+
+class _ExtractOptions(typing.NamedTuple):
+    output_dir: pathlib.Path
+    cache_dir: typing.Optional[pathlib.Path]
+    path_db_path: typing.Optional[pathlib.Path]
+    max_read_size: int
+
+
+def get_output_path(output_dir: pathlib.Path, index_path: pathlib.Path, path_spec: SqPathSpec) -> pathlib.Path:
+    if path_spec.has_full_path():
+        parts = path_spec.full_path.split("/")
+    else:
+        parts = [UNKNOWN_PATH_DIRECTORY, f"{index_path.parent.name}.{index_path.name.split('.')[0]}",
+                 *str(path_spec).split("/")]
+    if any(not x or x in (".", "..") for x in parts):
+        raise ValueError(f"{path_spec} is not a valid relative path")
+    return output_dir.joinpath(*parts)
+
+
+def _get_manifest_key(task: DatRange) -> str:
+    index_stat = task.index_path.stat()
+    data_stat = task.data_path.stat()
+    return (f"{task.name} {index_stat.st_size} {index_stat.st_mtime_ns} "
+            f"{data_stat.st_size} {data_stat.st_mtime_ns} {task.end:x}\n")
+
+
+def _read_manifest(path: pathlib.Path, key: str) -> typing.Set[int]:
+    # A manifest made for a different state of the source files is ignored, and gets rewritten from scratch.
+    try:
+        with path.open("r", encoding="utf-8") as fp:
+            if fp.readline() != key:
+                return set()
+            result = set()
+            for line in fp:
+                # A line cut short by an interrupted run has no newline; the entry is extracted again.
+                if line.endswith("\n"):
+                    result.add(int(line, 16))
+            return result
+    except FileNotFoundError:
+        return set()
+
+
+def _extract_task(task: DatRange, options: _ExtractOptions) -> ExtractTaskResult:
+    entries = get_dat_range_entries(task, options.cache_dir, options.path_db_path)
+
+    manifest_path = options.output_dir / MANIFEST_DIRECTORY / f"{task.name}.txt"
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    manifest_key = _get_manifest_key(task)
+    done = _read_manifest(manifest_path, manifest_key)
+    skipped = sum(1 for x in entries if x[0] in done)
+    entries = [x for x in entries if x[0] not in done]
+
+    bytes_read = bytes_written = 0
+    errors = []
+    with task.data_path.open("rb") as fp, manifest_path.open("a" if done else "w", encoding="utf-8") as manifest:
+        if not done:
+            manifest.write(manifest_key)
+            manifest.flush()
+
+        for view, read_entries in iter_merged_reads(fp, entries, options.max_read_size):
+            bytes_read += len(view)
+            read_from = read_entries[0][0]
+            for offset, stored_size, path_spec in read_entries:
+                try:
+                    data = decode_entry_data(view[offset - read_from:offset - read_from + stored_size])
+                    write_file_atomic(get_output_path(options.output_dir, task.index_path, path_spec), data)
+                except Exception as e:
+                    errors.append((f"{task.index_path.parent.name}/{task.index_path.name}:{path_spec}", repr(e)))
+                    continue
+                bytes_written += len(data)
+                manifest.write(f"{offset:x}\n")
+            manifest.flush()
+
+    return ExtractTaskResult(task, len(entries) - len(errors), skipped, bytes_read, bytes_written, errors)
+
+
+class SqpackExtractor:
+    # Writes every entry of an installation under output_dir, in parallel over worker processes.
+    # Work is split into tasks, each covering up to task_span bytes of a dat file; each worker reads its range in offset
+    # order, decodes, and writes the outputs itself, so memory use per worker stays around max_read_size, and only
+    # counters travel back to this process. Finished entries are appended to a manifest per task, so that an
+    # interrupted run picks up where it left off.
+    def __init__(self, resource_reader: 'GameResourceReader', output_dir: typing.Union[str, os.PathLike],
+                 max_workers: typing.Optional[int] = None,
+                 task_span: int = 0x20000000,
+                 max_read_size: int = 0x1000000,
+                 path_db: typing.Union[SqPathDatabase, str, os.PathLike, None] = None):
+        if path_db is None:
+            path_db = resource_reader.path_db
+        if isinstance(path_db, SqPathDatabase):
+            path_db = path_db.path
+
+        self._resource_reader = resource_reader
+        self._max_workers = max_workers
+        self._task_span = task_span
+        self._options = _ExtractOptions(
+            output_dir=pathlib.Path(output_dir),
+            cache_dir=None if resource_reader.cache_dir is None else pathlib.Path(resource_reader.cache_dir),
+            path_db_path=None if path_db is None else pathlib.Path(path_db),
+            max_read_size=max_read_size,
+        )
+
+    def get_tasks(self) -> typing.List[DatRange]:
+        return split_dat_ranges(self._resource_reader.sqpack_index_paths(), self._task_span)
+
+    def run(self, progress: typing.Optional[typing.Callable[[ExtractProgress], typing.Any]] = None
+            ) -> ExtractProgress:
+        tasks = self.get_tasks()
+        result = ExtractProgress(tasks_total=len(tasks))
+        start_time = time.monotonic()
+
+        def update(task_result: ExtractTaskResult):
+            result.tasks_done += 1
+            result.entries += task_result.entries
+            result.entries_skipped += task_result.entries_skipped
+            result.bytes_read += task_result.bytes_read
+            result.bytes_written += task_result.bytes_written
+            result.errors.extend(task_result.errors)
+            result.elapsed = time.monotonic() - start_time
+            if progress is not None:
+                progress(result)
+
+        for task_result in run_tasks(_extract_task, [(task, self._options) for task in tasks], self._max_workers):
+            update(task_result)
+
+        result.elapsed = time.monotonic() - start_time
+        return result
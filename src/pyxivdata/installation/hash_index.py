@@ -0,0 +1,167 @@
+import array
+import hashlib
+import pathlib
+import sys
+import typing
+
+from pyxivdata.common import SqPathSpec, CorruptDataException
+from pyxivdata.sqpack.hash_table import as_uint32_words, pair_hash_key
+from pyxivdata.sqpack.reader import SqIndexReader
+from pyxivdata.util.section_file import SectionFile, get_location_tag, remove_stale_files
+
+
+class SqpackHashIndexCache(SectionFile):
+    SIGNATURE: typing.ClassVar[bytes] = b"XIVHSIDX"
+    VERSION: typing.ClassVar[int] = 3
+
+
+def get_hash_index_cache_key(sqpack_path: pathlib.Path, index_paths: typing.Sequence[pathlib.Path]) -> bytes:
+    # Any patch rewrites the index files it touches, so their names, sizes and modification times are enough.
+    h = hashlib.sha1()
+    h.update(SqpackHashIndexCache.SIGNATURE)
+    h.update(SqpackHashIndexCache.VERSION.to_bytes(4, "little"))
+    h.update(sys.byteorder.encode("utf-8"))
+    for index_path in index_paths:
+        h.update(index_path.relative_to(sqpack_path).as_posix().encode("utf-8"))
+        for path in (index_path, index_path.with_suffix(".index2")):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                h.update(bytes(16))
+            else:
+                h.update(st.st_size.to_bytes(8, "little"))
+                h.update(st.st_mtime_ns.to_bytes(8, "little"))
+    return h.digest()
+
+
+# Sqpack number marking an unused slot of a hash index table.
+_EMPTY_SLOT = 0xFFFF
+
+
+def _get_slot(key: int, mask: int) -> int:
+    # Fibonacci hashing; the top bits of the product are spread well even for keys differing only in their low bits.
+    return ((key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> 32 & mask
+
+
+def _build_table(keys: array.array, sqpacks: array.array) -> typing.Tuple[array.array, array.array]:
+    # Open addressing with linear probing, at most half full. A hash found in several sqpacks takes one slot for each.
+    size = 1
+    while size < 2 * len(keys):
+        size <<= 1
+    mask = size - 1
+    table_keys = array.array(keys.typecode, bytes(keys.itemsize * size))
+    table_sqpacks = array.array("H", [_EMPTY_SLOT]) * size
+    for key, sqpack in zip(keys, sqpacks):
+        i = _get_slot(key, mask)
+        while table_sqpacks[i] != _EMPTY_SLOT:
+            if table_keys[i] == key and table_sqpacks[i] == sqpack:
+                break
+            i = (i + 1) & mask
+        else:
+            table_keys[i] = key
+            table_sqpacks[i] = sqpack
+    return table_keys, table_sqpacks
+
+
+class SqpackHashIndex:
+    # Which sqpacks contain an entry with a given pair hash or full path hash, over a whole installation.
+    # Each kind of hash has a hash table laid out in two flat arrays of slots, a key and a sqpack number each, which
+    # are used straight from the mapped cache file; lookups take expected constant time, with nothing to build first.
+
+    def __init__(self, index_paths: typing.Sequence[pathlib.Path],
+                 pair_hash_keys: typing.Sequence[int], pair_hash_sqpacks: typing.Sequence[int],
+                 full_path_hash_keys: typing.Sequence[int], full_path_hash_sqpacks: typing.Sequence[int],
+                 cache: typing.Optional[SqpackHashIndexCache] = None):
+        self._index_paths = list(index_paths)
+        self._cache = cache
+        self._pair_hash_keys = pair_hash_keys
+        self._pair_hash_sqpacks = pair_hash_sqpacks
+        self._full_path_hash_keys = full_path_hash_keys
+        self._full_path_hash_sqpacks = full_path_hash_sqpacks
+
+    @classmethod
+    def build(cls, index_paths: typing.Sequence[pathlib.Path]) -> 'SqpackHashIndex':
+        pair_hash_keys = array.array("Q")
+        pair_hash_sqpacks = array.array("H")
+        full_path_hash_keys = array.array("I")
+        full_path_hash_sqpacks = array.array("H")
+        for i, index_path in enumerate(index_paths):
+            with SqIndexReader(index_path, index_path.with_suffix(".index2")) as index:
+                words = as_uint32_words(index.pair_hash_locators)
+                pair_hash_keys.extend(map(pair_hash_key, words[1::4], words[0::4]))
+                pair_hash_sqpacks.extend([i] * (len(words) // 4))
+
+                words = as_uint32_words(index.full_path_hash_locators)
+                full_path_hash_keys.extend(words[0::2])
+                full_path_hash_sqpacks.extend([i] * (len(words) // 2))
+
+        return cls(index_paths, *_build_table(pair_hash_keys, pair_hash_sqpacks),
+                   *_build_table(full_path_hash_keys, full_path_hash_sqpacks))
+
+    @classmethod
+    def load_or_build(cls, sqpack_path: pathlib.Path, index_paths: typing.Sequence[pathlib.Path],
+                      cache_dir: typing.Optional[pathlib.Path] = None) -> 'SqpackHashIndex':
+        # The arrays are used straight from the mapped cache file, which stays open until close.
+        if cache_dir is None:
+            return cls.build(index_paths)
+
+        key = get_hash_index_cache_key(sqpack_path, index_paths)
+        name = f"sqpack.{get_location_tag(sqpack_path)}"
+        cache_path = cache_dir / f"{name}.{key.hex()}.hashes"
+        try:
+            cache = SqpackHashIndexCache(cache_path, key)
+        except (OSError, ValueError, CorruptDataException):
+            result = cls.build(index_paths)
+            try:
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                SqpackHashIndexCache.write(cache_path, key, {
+                    "pair_hash_keys": result._pair_hash_keys,
+                    "pair_hash_sqpacks": result._pair_hash_sqpacks,
+                    "full_path_hash_keys": result._full_path_hash_keys,
+                    "full_path_hash_sqpacks": result._full_path_hash_sqpacks,
+                })
+            except OSError:
+                pass
+            else:
+                remove_stale_files(cache_path, f"{name}.{'?' * len(key.hex())}.hashes")
+            return result
+
+        try:
+            return cls(index_paths, cache["pair_hash_keys"], cache["pair_hash_sqpacks"],
+                       cache["full_path_hash_keys"], cache["full_path_hash_sqpacks"], cache)
+        except BaseException:
+            cache.close()
+            raise
+
+    def close(self):
+        self._pair_hash_keys = self._pair_hash_sqpacks = None
+        self._full_path_hash_keys = self._full_path_hash_sqpacks = None
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+
+    @property
+    def index_paths(self) -> typing.List[pathlib.Path]:
+        return self._index_paths
+
+    def __len__(self):
+        return len(self._index_paths)
+
+    def find(self, item: SqPathSpec) -> typing.List[pathlib.Path]:
+        # Index paths of the sqpacks that may contain item, in installation order; empty if none does.
+        lookups = []
+        if item.has_path_name_hash():
+            lookups.append((self._pair_hash_keys, self._pair_hash_sqpacks,
+                            pair_hash_key(item.path_hash, item.name_hash)))
+        if item.has_full_path_hash():
+            lookups.append((self._full_path_hash_keys, self._full_path_hash_sqpacks, item.full_path_hash))
+
+        sqpacks = set()
+        for keys, key_sqpacks, key in lookups:
+            mask = len(keys) - 1
+            i = _get_slot(key, mask)
+            while key_sqpacks[i] != _EMPTY_SLOT:
+                if keys[i] == key:
+                    sqpacks.add(key_sqpacks[i])
+                i = (i + 1) & mask
+        return [self._index_paths[i] for i in sorted(sqpacks)]
@@ -1,14 +1,21 @@
+import concurrent.futures
 import functools
 import os
 import pathlib
+import threading
 import typing
 
 from pyxivdata.common import SqPathSpec, GameLanguage, GameInstallationRegion
 from pyxivdata.escaped_string import SeString
 from pyxivdata.installation.game_locator import GameInstallation, GameLocator
-from pyxivdata.resource.excel.reader import ExcelReader, ExdRow
+from pyxivdata.installation.hash_index import SqpackHashIndex
+from pyxivdata.resource.excel.reader import ExcelReader, ExdRow, get_exd_rows_data_size
 from pyxivdata.resource.excel.rowdef import StatusRow
-from pyxivdata.sqpack.reader import SqpackReader
+from pyxivdata.sqpack.path_db import SqPathDatabase
+from pyxivdata.sqpack.reader import SqpackReader, SqpackEntryStat, EntryCacheKey
+from pyxivdata.util.after_fork import register_after_fork_in_child
+from pyxivdata.util.file_pool import FilePool
+from pyxivdata.util.lru_cache import LruCache, LruCacheStats
 
 SQPACK_CATEGORY_MAP = {
     "common": "000000",
@@ -26,13 +33,38 @@ SQPACK_CATEGORY_MAP = {
 }
 EXPAC_DEPENDENT_SQPACKS = ("0c0000", "020000", "030000")
 
+# Bytes counted for each cached excel row on top of its data, when the row cache is bounded by size; also the size
+# counted for a cached miss.
+EXCEL_ROW_CACHE_ENTRY_OVERHEAD = 256
+
+# (row id, requested language) of a cached excel row; a language of None stands for the default languages.
+ExcelRowCacheKey = typing.Tuple[int, typing.Optional[GameLanguage]]
+
+
+def _get_excel_row_cache_entry_size(row: typing.Union[ExdRow, typing.List[ExdRow], None]) -> int:
+    if row is None:
+        return EXCEL_ROW_CACHE_ENTRY_OVERHEAD
+    rows = row if isinstance(row, list) else [row]
+    return EXCEL_ROW_CACHE_ENTRY_OVERHEAD * len(rows) + get_exd_rows_data_size(rows)
+
 
 class GameResourceReader:
-    _default_languages: typing.List[GameLanguage] = [GameLanguage.Undefined]
+    _default_languages: typing.Optional[typing.List[GameLanguage]] = None
 
     def __init__(self,
                  installation: typing.Union[GameInstallationRegion, GameInstallation, str, os.PathLike, None] = None,
-                 default_language: typing.Union[GameLanguage, typing.Sequence[GameLanguage], None] = None):
+                 default_language: typing.Union[GameLanguage, typing.Sequence[GameLanguage], None] = None,
+                 use_mmap: bool = False,
+                 use_hash_table: bool = False,
+                 cache_dir: typing.Union[str, os.PathLike, None] = None,
+                 executor: typing.Optional[concurrent.futures.Executor] = None,
+                 entry_cache_size: int = 0,
+                 path_db: typing.Optional[SqPathDatabase] = None,
+                 max_open_data_files: typing.Optional[int] = None,
+                 file_pool: typing.Optional[FilePool] = None,
+                 fork_safe: bool = False,
+                 excel_row_cache_entries: int = 1024,
+                 excel_row_cache_bytes: typing.Optional[int] = None):
         if installation is None:
             try:
                 installation = GameLocator()[0]
@@ -55,62 +87,199 @@ class GameResourceReader:
             raise TypeError
 
         self._game_path = installation.game_path
+        self._use_mmap = use_mmap
+        self._use_hash_table = use_hash_table
+        self._cache_dir = cache_dir
+        self._executor = executor
+        self._entry_cache: typing.Optional[LruCache[EntryCacheKey, bytearray]] = None
+        if entry_cache_size:
+            self._entry_cache = LruCache(entry_cache_size)
+        self._path_db = path_db
+        # Index and data files of every sqpack share one pool; pass the same file_pool to several readers to bound them
+        # together, across installations. Mapped index files (use_mmap) are not in the pool.
+        self._file_pool = file_pool
+        if self._file_pool is None and max_open_data_files is not None:
+            self._file_pool = FilePool(max_open_data_files)
         self._readers: typing.Dict[pathlib.Path, SqpackReader] = {}
-        self._open_all_attempted = False
+        self._readers_lock = threading.Lock()
+        self._hash_index: typing.Optional[SqpackHashIndex] = None
+        self._fork_safe = fork_safe
+        register_after_fork_in_child(self)
         self._excel_readers: typing.Dict[str, ExcelReader] = {}
-
+        # Rows returned by get_excel_row, in one cache per sheet, each bounded by excel_row_cache_bytes if given, or by
+        # excel_row_cache_entries otherwise.
+        self._excel_row_caches: typing.Dict[str, LruCache[ExcelRowCacheKey, typing.Optional[ExdRow]]] = {}
+        self._excel_row_cache_entries = excel_row_cache_entries
+        self._excel_row_cache_bytes = excel_row_cache_bytes
+
+        # Without default_language, the languages of the Action sheet are used; they are looked up on first use, so
+        # that constructing a reader does no I/O beyond locating the installation.
         if default_language is None:
-            self._default_languages = list(self.excels["Action"].languages)
+            self._default_languages = None
         elif isinstance(default_language, GameLanguage):
             self._default_languages = [default_language]
         else:
             self._default_languages = list(default_language)
 
-    def __getitem__(self, item: typing.Union[SqPathSpec, str, bytes, os.PathLike]):
-        item = SqPathSpec(item)
+    def _get_index_path_from_full_path(self, full_path: str) -> pathlib.Path:
+        path_components = full_path.split("/")
+        category = path_components[0]
+        sqpack = SQPACK_CATEGORY_MAP[category]
+        if sqpack in EXPAC_DEPENDENT_SQPACKS:
+            expac = path_components[1]
+            try:
+                ind = int(path_components[2][:2], 16)
+            except ValueError:
+                ind = 0
+            if path_components[1] == 'ffxiv':
+                expac_ver = 0
+            else:
+                expac_ver = int(path_components[1][2:], 16)
+            sqpack = f"{sqpack[0:2]}{expac_ver:02x}{ind:02x}"
+        else:
+            expac = "ffxiv"
+        return self._game_path / "sqpack" / expac / f"{sqpack}.win32.index"
+
+    def _get_reader(self, index_path: pathlib.Path) -> SqpackReader:
+        reader = self._readers.get(index_path)
+        if reader is None:
+            with self._readers_lock:
+                reader = self._readers.get(index_path)
+                if reader is None:
+                    reader = self._readers[index_path] = self._open_sqpack(index_path)
+        return reader
+
+    @property
+    def hash_index(self) -> SqpackHashIndex:
+        if self._hash_index is None:
+            with self._readers_lock:
+                if self._hash_index is None:
+                    self._hash_index = SqpackHashIndex.load_or_build(
+                        self._game_path / "sqpack", self.sqpack_index_paths(),
+                        None if self._cache_dir is None else pathlib.Path(self._cache_dir))
+        return self._hash_index
+
+    def _find_reader(self, item: SqPathSpec) -> SqpackReader:
+        # Full paths are routed by their category and expansion folder; if that fails, and for hash-only paths,
+        # the installation wide hash index tells which sqpacks have the hashes.
         if item.has_full_path():
-            path_components = item.full_path.split("/")
-            category = path_components[0]
-            sqpack = SQPACK_CATEGORY_MAP[category]
-            if sqpack in EXPAC_DEPENDENT_SQPACKS:
-                expac = path_components[1]
-                try:
-                    ind = int(path_components[2][:2], 16)
-                except ValueError:
-                    ind = 0
-                if path_components[1] == 'ffxiv':
-                    expac_ver = 0
-                else:
-                    expac_ver = int(path_components[1][2:], 16)
-                sqpack = f"{sqpack[0:2]}{expac_ver:02x}{ind:02x}"
+            try:
+                index_path = self._get_index_path_from_full_path(item.full_path)
+            except (KeyError, ValueError, IndexError):
+                pass
             else:
-                expac = "ffxiv"
-            index_path = self._game_path / "sqpack" / expac / f"{sqpack}.win32.index"
-            if index_path not in self._readers:
-                self._readers[index_path] = SqpackReader(index_path)
-            return self._readers[index_path][item]
-
-        if not self._open_all_attempted:
-            self._open_all_attempted = True
-            for expac_path in (self._game_path / "sqpack").iterdir():
-                if not expac_path.is_dir():
-                    continue
-                for path in expac_path.iterdir():
-                    if not path.is_file():
-                        continue
-                    if not path.name.lower().endswith(".win32.index"):
-                        continue
-                    self._readers[path] = SqpackReader(path)
+                return self._get_reader(index_path)
 
-        for reader in self._readers.values():
-            reader: SqpackReader
+        index_paths = self.hash_index.find(item)
+        if len(index_paths) == 1:
+            return self._get_reader(index_paths[0])
+
+        # Same hashes in more than one sqpack.
+        for index_path in index_paths:
+            reader = self._get_reader(index_path)
             try:
-                return reader[item]
+                reader.get_locator(item)
+                return reader
             except KeyError:
                 continue
 
         raise KeyError(f"{item} not found in any sqpack file")
 
+    @property
+    def game_path(self) -> pathlib.Path:
+        return self._game_path
+
+    @property
+    def cache_dir(self) -> typing.Union[str, os.PathLike, None]:
+        return self._cache_dir
+
+    @property
+    def path_db(self) -> typing.Optional[SqPathDatabase]:
+        return self._path_db
+
+    def sqpack_index_paths(self) -> typing.List[pathlib.Path]:
+        result = []
+        for expac_path in sorted((self._game_path / "sqpack").iterdir()):
+            if not expac_path.is_dir():
+                continue
+            for path in sorted(expac_path.iterdir()):
+                if not path.is_file():
+                    continue
+                if not path.name.lower().endswith(".win32.index"):
+                    continue
+                result.append(path)
+        return result
+
+    def __getitem__(self, item: typing.Union[SqPathSpec, str, bytes, os.PathLike]):
+        item = SqPathSpec(item)
+        return self._find_reader(item)[item]
+
+    def read_many(self, items: typing.Iterable[typing.Union[SqPathSpec, str, bytes, os.PathLike]]
+                  ) -> typing.Iterator[typing.Tuple[SqPathSpec, bytearray]]:
+        groups: typing.Dict[SqpackReader, typing.List[SqPathSpec]] = {}
+        for item in items:
+            item = SqPathSpec(item)
+            groups.setdefault(self._find_reader(item), []).append(item)
+
+        for reader, group in groups.items():
+            yield from reader.read_many(group)
+
+    def stat(self, item: typing.Union[SqPathSpec, str, bytes, os.PathLike]) -> SqpackEntryStat:
+        item = SqPathSpec(item)
+        return self._find_reader(item).stat(item)
+
+    def stat_many(self, items: typing.Iterable[typing.Union[SqPathSpec, str, bytes, os.PathLike]]
+                  ) -> typing.Iterator[SqpackEntryStat]:
+        groups: typing.Dict[SqpackReader, typing.List[SqPathSpec]] = {}
+        for item in items:
+            item = SqPathSpec(item)
+            groups.setdefault(self._find_reader(item), []).append(item)
+
+        for reader, group in groups.items():
+            yield from reader.stat_many(group)
+
+    def _open_sqpack(self, index_path: pathlib.Path) -> SqpackReader:
+        return SqpackReader(index_path, use_mmap=self._use_mmap, use_hash_table=self._use_hash_table,
+                            cache_dir=self._cache_dir, executor=self._executor, entry_cache=self._entry_cache,
+                            path_db=self._path_db, file_pool=self._file_pool)
+
+    @property
+    def entry_cache(self) -> typing.Optional[LruCache[EntryCacheKey, bytearray]]:
+        return self._entry_cache
+
+    @property
+    def file_pool(self) -> typing.Optional[FilePool]:
+        return self._file_pool
+
+    def set_executor(self, executor: typing.Optional[concurrent.futures.Executor]):
+        with self._readers_lock:
+            self._executor = executor
+            for reader in self._readers.values():
+                reader.set_executor(executor)
+
+    def _after_fork_in_child(self):
+        self._readers_lock = threading.Lock()
+        if not self._fork_safe:
+            return
+
+        # Threads of an executor do not survive a fork; decode on the calling thread until set_executor is called.
+        self.set_executor(None)
+        for reader in self._readers.values():
+            reader.reopen_data_files()
+
+    def preload(self, excel_sheets: typing.Iterable[str] = ()):
+        # Opens every sqpack and builds the lookup structures otherwise built on first use, along with the given excel
+        # sheets, so that worker processes forked afterwards inherit them instead of each building their own.
+        for index_path in self.sqpack_index_paths():
+            self._get_reader(index_path).preload()
+        _ = self.hash_index
+        for name in excel_sheets:
+            _ = self.excels[name]
+
+    def invalidate_entry_cache(self):
+        if self._entry_cache is not None:
+            self._entry_cache.clear()
+
     def __enter__(self):
         return self
 
@@ -121,11 +290,25 @@ class GameResourceReader:
         for f in self._readers.values():
             f.close()
         self._readers.clear()
+        if self._hash_index is not None:
+            self._hash_index.close()
+            self._hash_index = None
         self._excel_readers.clear()
+        self._excel_row_caches.clear()
+
+    @property
+    def default_languages(self) -> typing.List[GameLanguage]:
+        if self._default_languages is None:
+            languages = list(self.excels["Action"].languages)
+            self._default_languages = languages
+            for r in self._excel_readers.values():
+                r.set_default_languages(*languages)
+        return self._default_languages
 
     def set_default_language(self, *language: GameLanguage) -> typing.NoReturn:
         self._default_languages = list(language)
-        self.get_excel_row.cache_clear()
+        for cache in list(self._excel_row_caches.values()):
+            cache.invalidate_if(lambda key: key[1] is None)
         for r in self._excel_readers.values():
             r.set_default_languages(*self._default_languages)
 
@@ -145,8 +328,9 @@ class GameResourceReader:
                     raise TypeError
                 item = item.lower()
                 if item not in outer_self._excel_readers:
-                    outer_self._excel_readers[item] = ExcelReader(outer_self, item, outer_self._default_languages,
-                                                                  self.__getitem__)
+                    # The Action sheet decides the default languages, and is given the final ones once they are known.
+                    languages = outer_self._default_languages if item == "action" else outer_self.default_languages
+                    outer_self._excel_readers[item] = ExcelReader(outer_self, item, languages, self.__getitem__)
                 return outer_self._excel_readers[item]
 
             @property
@@ -167,10 +351,51 @@ class GameResourceReader:
 
         return _Impl()
 
-    @functools.cache
+    def _get_excel_row_cache(self, excel_name: str) -> LruCache[ExcelRowCacheKey, typing.Optional[ExdRow]]:
+        cache = self._excel_row_caches.get(excel_name)
+        if cache is None:
+            if self._excel_row_cache_bytes is None:
+                cache = LruCache(self._excel_row_cache_entries, lambda _: 1)
+            else:
+                cache = LruCache(self._excel_row_cache_bytes, _get_excel_row_cache_entry_size)
+            cache = self._excel_row_caches.setdefault(excel_name, cache)
+        return cache
+
+    def get_excel_row_cache_stats(self) -> typing.Dict[str, LruCacheStats]:
+        return {name: cache.stats for name, cache in list(self._excel_row_caches.items())}
+
+    def invalidate_excel_row_cache(self, excel_name: typing.Union[str, int, None] = None,
+                                   row_id: typing.Optional[int] = None) -> int:
+        # Drops cached rows of one sheet, or of every sheet, optionally only those of row_id; returns how many.
+        if excel_name is None:
+            caches = list(self._excel_row_caches.values())
+        else:
+            caches = [self._excel_row_caches.get(self._get_excel_name(excel_name))]
+        count = 0
+        for cache in caches:
+            if cache is None:
+                continue
+            elif row_id is None:
+                count += len(cache)
+                cache.clear()
+            else:
+                count += cache.invalidate_if(lambda key: key[0] == row_id)
+        return count
+
+    def _get_excel_name(self, excel_name: typing.Union[str, int]) -> str:
+        # Sheets are cached by lowercase name, whether they are asked for by name or by id.
+        if isinstance(excel_name, int):
+            return self.excels.id_to_name[excel_name].lower()
+        return excel_name.lower()
+
     def get_excel_row(
-            self, excel_name: str, row_id: int, language: typing.Optional[GameLanguage] = None
+            self, excel_name: typing.Union[str, int], row_id: int, language: typing.Optional[GameLanguage] = None
     ) -> typing.Optional[ExdRow]:
+        return self._get_excel_row_cache(self._get_excel_name(excel_name)).get_or_load(
+            (row_id, language), lambda: self._read_excel_row(excel_name, row_id, language))
+
+    def _read_excel_row(self, excel_name: typing.Union[str, int], row_id: int, language: typing.Optional[GameLanguage]
+                        ) -> typing.Optional[ExdRow]:
         reader = self.excels[excel_name]
         if GameLanguage.Undefined in reader.languages:
             language = GameLanguage.Undefined
@@ -178,7 +403,7 @@ class GameResourceReader:
             if language is not None:
                 return reader[language, row_id]
             else:
-                for language in self._default_languages:
+                for language in self.default_languages:
                     if language in reader.languages:
                         try:
                             return reader[language, row_id]
@@ -0,0 +1,233 @@
+import ctypes
+import hashlib
+import pathlib
+import time
+import typing
+
+from pyxivdata.installation.dat_range import DatRange, split_dat_ranges, get_dat_range_entries, iter_merged_reads, \
+    run_tasks
+from pyxivdata.sqpack.entry_decoder import read_at, decode_entry_data
+from pyxivdata.sqpack.path_db import SqPathDatabase
+from pyxivdata.sqpack.structures import SqpackHeader, SqIndexHeader, SqDataHeader, SqDataFileEntryHeader, \
+    SqDataFileEntryType
+
+if typing.TYPE_CHECKING:
+    from pyxivdata.installation.resource_reader import GameResourceReader
+
+# Bytes hashed at once while checking data_sha1 of a dat file.
+HASH_READ_SIZE = 0x1000000
+
+_EMPTY_SHA1 = hashlib.sha1().digest()
+
+
+class VerifyIssue(typing.NamedTuple):
+    path: pathlib.Path
+    location: str
+    message: str
+
+    def __str__(self):
+        return f"{self.path}: {self.location}: {self.message}"
+
+
+class VerifyReport(typing.NamedTuple):
+    # Outcome of one unit of work: the headers of one file, or the entries in one range of a dat file.
+    path: pathlib.Path
+    name: str
+    bytes_read: int
+    entries: int
+    elapsed: float
+    issues: typing.List[VerifyIssue]
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes_read / 1048576 / self.elapsed if self.elapsed else 0.
+
+
+class _VerifyOptions(typing.NamedTuple):
+    hash_data: bool
+    cache_dir: typing.Optional[pathlib.Path]
+    path_db_path: typing.Optional[pathlib.Path]
+    max_read_size: int
+
+
+def _check_sha1(issues: typing.List[VerifyIssue], path: pathlib.Path, location: str, data: bytes,
+                expected: bytearray):
+    # Empty segments are stored with either the digest of nothing or all zeroes.
+    expected = bytes(expected)
+    if not data and expected in (_EMPTY_SHA1, bytes(len(expected))):
+        return
+    digest = hashlib.sha1(data).digest()
+    if digest != expected:
+        issues.append(VerifyIssue(path, location, f"SHA-1 mismatch (expected {expected.hex()}, got {digest.hex()})"))
+
+
+def _read_struct(fp: typing.BinaryIO, offset: int, struct_type: typing.Type[ctypes.Structure]
+                 ) -> typing.Tuple[typing.Optional[ctypes.Structure], bytearray]:
+    data = read_at(fp, offset, ctypes.sizeof(struct_type))
+    if len(data) != ctypes.sizeof(struct_type):
+        return None, data
+    return struct_type.from_buffer_copy(data), data
+
+
+def _verify_sqpack_header(issues: typing.List[VerifyIssue], path: pathlib.Path, fp: typing.BinaryIO
+                          ) -> typing.Optional[SqpackHeader]:
+    header, data = _read_struct(fp, 0, SqpackHeader)
+    if header is None:
+        issues.append(VerifyIssue(path, "SqpackHeader", "truncated"))
+        return None
+    if header.signature != b"SqPack":
+        issues.append(VerifyIssue(path, "SqpackHeader", f"bad signature {header.signature!r}"))
+    _check_sha1(issues, path, "SqpackHeader", data[:SqpackHeader.sha1.offset], header.sha1)
+    return header
+
+
+def _verify_index_file(path: pathlib.Path, options: _VerifyOptions) -> typing.Tuple[int, typing.List[VerifyIssue]]:
+    issues = []
+    bytes_read = 0
+    with path.open("rb") as fp:
+        header = _verify_sqpack_header(issues, path, fp)
+        if header is None:
+            return bytes_read, issues
+        index, data = _read_struct(fp, header.header_size, SqIndexHeader)
+        bytes_read += header.header_size + len(data)
+        if index is None:
+            issues.append(VerifyIssue(path, "SqIndexHeader", "truncated"))
+            return bytes_read, issues
+        _check_sha1(issues, path, "SqIndexHeader", data[:SqIndexHeader.sha1.offset], index.sha1)
+
+        for name in ("hash_locator_segment", "text_locator_segment", "unknown_segment_3",
+                     "path_hash_locator_segment"):
+            segment = getattr(index, name)
+            data = read_at(fp, segment.offset, segment.size)
+            bytes_read += len(data)
+            if len(data) != segment.size:
+                issues.append(VerifyIssue(path, name, "truncated"))
+            else:
+                _check_sha1(issues, path, name, data, segment.sha1)
+    return bytes_read, issues
+
+
+def _verify_data_file(path: pathlib.Path, options: _VerifyOptions) -> typing.Tuple[int, typing.List[VerifyIssue]]:
+    issues = []
+    bytes_read = 0
+    with path.open("rb") as fp:
+        header = _verify_sqpack_header(issues, path, fp)
+        if header is None:
+            return bytes_read, issues
+        data_header, data = _read_struct(fp, header.header_size, SqDataHeader)
+        bytes_read += header.header_size + len(data)
+        if data_header is None:
+            issues.append(VerifyIssue(path, "SqDataHeader", "truncated"))
+            return bytes_read, issues
+        _check_sha1(issues, path, "SqDataHeader", data[:SqDataHeader.sha1.offset], data_header.sha1)
+
+        if options.hash_data and any(data_header.data_sha1):
+            # data_sha1 covers data_size bytes following the headers.
+            h = hashlib.sha1()
+            offset = header.header_size + data_header.header_size
+            end = offset + data_header.data_size
+            while offset < end:
+                data = read_at(fp, offset, min(HASH_READ_SIZE, end - offset))
+                if not data:
+                    issues.append(VerifyIssue(path, "SqDataHeader.data_sha1", f"data is truncated at {offset:#x}"))
+                    return bytes_read, issues
+                h.update(data)
+                offset += len(data)
+                bytes_read += len(data)
+            if h.digest() != bytes(data_header.data_sha1):
+                issues.append(VerifyIssue(path, "SqDataHeader.data_sha1",
+                                          f"SHA-1 mismatch (expected {bytes(data_header.data_sha1).hex()}, "
+                                          f"got {h.hexdigest()})"))
+    return bytes_read, issues
+
+
+def _verify_dat_range(task: DatRange, options: _VerifyOptions
+                      ) -> typing.Tuple[int, int, typing.List[VerifyIssue]]:
+    entries = get_dat_range_entries(task, options.cache_dir, options.path_db_path)
+    issues = []
+    bytes_read = 0
+    with task.data_path.open("rb") as fp:
+        for view, read_entries in iter_merged_reads(fp, entries, options.max_read_size):
+            bytes_read += len(view)
+            read_from = read_entries[0][0]
+            for offset, stored_size, path_spec in read_entries:
+                location = f"{path_spec} at {offset:#x}"
+                data = view[offset - read_from:offset - read_from + stored_size]
+                if len(data) < ctypes.sizeof(SqDataFileEntryHeader):
+                    issues.append(VerifyIssue(task.data_path, location, "entry points past the end of the file"))
+                    continue
+                header = SqDataFileEntryHeader.from_buffer_copy(data)
+                try:
+                    decoded = decode_entry_data(data)
+                except Exception as e:
+                    issues.append(VerifyIssue(task.data_path, location, f"failed to decode: {e!r}"))
+                    continue
+                if header.type == SqDataFileEntryType.Binary and len(decoded) != header.decompressed_size:
+                    issues.append(VerifyIssue(task.data_path, location, f"decoded to {len(decoded)} bytes, "
+                                                                        f"expected {header.decompressed_size} bytes"))
+    return bytes_read, len(entries), issues
+
+
+def _verify_task(kind: str, target: typing.Union[pathlib.Path, DatRange], options: _VerifyOptions) -> VerifyReport:
+    start_time = time.monotonic()
+    if kind == "index":
+        bytes_read, issues = _verify_index_file(target, options)
+        return VerifyReport(target, target.name, bytes_read, 0, time.monotonic() - start_time, issues)
+    elif kind == "data":
+        bytes_read, issues = _verify_data_file(target, options)
+        return VerifyReport(target, target.name, bytes_read, 0, time.monotonic() - start_time, issues)
+    elif kind == "entries":
+        bytes_read, entries, issues = _verify_dat_range(target, options)
+        return VerifyReport(target.data_path, target.name, bytes_read, entries, time.monotonic() - start_time,
+                            issues)
+    else:
+        raise AssertionError
+
+
+class SqpackVerifier:
+    # Checks the SHA-1 digests stored in the headers of every index and dat file of an installation, the digest of
+    # every index segment, and optionally the digest of all data in dat files (hash_data) and whether every entry
+    # decodes (decode_entries). Files and dat ranges are checked in parallel over worker processes; run yields one
+    # report per unit of work as soon as it is done.
+    def __init__(self, resource_reader: 'GameResourceReader',
+                 max_workers: typing.Optional[int] = None,
+                 hash_data: bool = False,
+                 decode_entries: bool = False,
+                 task_span: int = 0x20000000,
+                 max_read_size: int = 0x1000000,
+                 path_db: typing.Union[SqPathDatabase, str, pathlib.Path, None] = None):
+        if path_db is None:
+            path_db = resource_reader.path_db
+        if isinstance(path_db, SqPathDatabase):
+            path_db = path_db.path
+
+        self._resource_reader = resource_reader
+        self._max_workers = max_workers
+        self._decode_entries = decode_entries
+        self._task_span = task_span
+        self._options = _VerifyOptions(
+            hash_data=hash_data,
+            cache_dir=None if resource_reader.cache_dir is None else pathlib.Path(resource_reader.cache_dir),
+            path_db_path=None if path_db is None else pathlib.Path(path_db),
+            max_read_size=max_read_size,
+        )
+
+    def get_tasks(self) -> typing.List[typing.Tuple[str, typing.Union[pathlib.Path, DatRange]]]:
+        index_paths = self._resource_reader.sqpack_index_paths()
+        result = []
+        for index_path in index_paths:
+            for path in (index_path, index_path.with_suffix(".index2")):
+                if path.exists():
+                    result.append(("index", path))
+
+        for data_range in split_dat_ranges(index_paths, 1 << 63):
+            result.append(("data", data_range.data_path))
+
+        if self._decode_entries:
+            for data_range in split_dat_ranges(index_paths, self._task_span):
+                result.append(("entries", data_range))
+        return result
+
+    def run(self) -> typing.Iterator[VerifyReport]:
+        return run_tasks(_verify_task, [(kind, target, self._options) for kind, target in self.get_tasks()],
+                         self._max_workers)
@@ -133,6 +133,16 @@ class ExdRow:
         return f"{self.__class__.__name__}({self.row_id}: {self[0]})"
 
 
+def get_exd_rows_data_size(rows: typing.Iterable[ExdRow]) -> int:
+    # Bytes of row data referenced by rows. Sub-rows of a row share its variable data, which is counted once.
+    fixed_size = 0
+    variable_sizes = {}
+    for row in rows:
+        fixed_size += len(row._fixed_data)
+        variable_sizes[id(row._variable_data)] = len(row._variable_data)
+    return fixed_size + sum(variable_sizes.values())
+
+
 if True:
     # noinspection PyUnresolvedReferences
     from . import rowdef
@@ -0,0 +1,63 @@
+import random
+import sys
+import time
+import zlib
+
+from pyxivdata.sqpack.deflate import get_available_inflate_backend_names, get_inflate_function
+
+BLOCK_SIZE = 16000
+
+
+def make_blocks(count: int):
+    # A mix of text-like, structured, and incompressible data, compressed the way sqpack blocks are.
+    rnd = random.Random(0)
+    words = [bytes(rnd.choice(b"abcdefghijklmnopqrstuvwxyz") for _ in range(rnd.randrange(2, 10))) for _ in range(500)]
+    blocks = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            raw = b" ".join(rnd.choice(words) for _ in range(BLOCK_SIZE // 4))[:BLOCK_SIZE]
+        elif kind == 1:
+            raw = b"".join(rnd.randrange(64).to_bytes(2, "little") + bytes(2) for _ in range(BLOCK_SIZE // 4))
+        else:
+            raw = rnd.randbytes(BLOCK_SIZE)
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        blocks.append((compressor.compress(raw) + compressor.flush(), len(raw)))
+    return blocks
+
+
+def measure(fn, blocks, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for data, size in blocks:
+            fn(data, size)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def __main__():
+    blocks = make_blocks(int(sys.argv[1]) if len(sys.argv) > 1 else 3000)
+    total = sum(size for _, size in blocks)
+    expected = [zlib.decompress(data, -zlib.MAX_WBITS, size) for data, size in blocks]
+
+    candidates = {name: get_inflate_function(name) for name in get_available_inflate_backend_names()}
+
+    # Python's zlib has no inflateReset, so a decompressor cannot be reused across blocks; these show what the
+    # closest alternatives cost compared with a one-shot decompress.
+    template = zlib.decompressobj(-zlib.MAX_WBITS)
+    candidates["zlib decompressobj"] = lambda data, size: zlib.decompressobj(-zlib.MAX_WBITS).decompress(data, size)
+    candidates["zlib decompressobj.copy"] = lambda data, size: template.copy().decompress(data, size)
+
+    print(f"{len(blocks)} blocks, {total / 1048576:.1f}MiB decompressed")
+    baseline = None
+    for name, fn in candidates.items():
+        assert [fn(data, size) for data, size in blocks] == expected, name
+        elapsed = measure(fn, blocks)
+        baseline = baseline or elapsed
+        print(f"{name:24} {elapsed * 1000:8.1f}ms {total / 1048576 / elapsed:8.1f}MiB/s "
+              f"{elapsed / len(blocks) * 1e6:6.1f}us/block ({baseline / elapsed:.2f}x)")
+
+
+if __name__ == "__main__":
+    exit(__main__())
@@ -0,0 +1,66 @@
+import random
+import time
+import typing
+
+from pyxivdata.common import PATH_HASH_TABLE, calculate_path_hash, calculate_path_hashes
+
+
+def calculate_path_hash_reference(path: bytes) -> int:
+    # Previous pure Python slicing-by-4 implementation.
+    path = path.replace(b"\\", b"/").lower()
+    result = 0xFFFFFFFF
+
+    i = 0
+    while i < len(path) // 4 * 4:
+        result ^= int.from_bytes(path[i:i + 4], "little", signed=False)
+        result = (PATH_HASH_TABLE[3][0xFF & (result >> 0)] ^
+                  PATH_HASH_TABLE[2][0xFF & (result >> 8)] ^
+                  PATH_HASH_TABLE[1][0xFF & (result >> 16)] ^
+                  PATH_HASH_TABLE[0][0xFF & (result >> 24)])
+        i += 4
+
+    for i in range(i, len(path)):
+        result = PATH_HASH_TABLE[0][(result ^ path[i]) & 0xFF] ^ (result >> 8)
+
+    return result
+
+
+def split_hashes_reference(path: bytes) -> typing.Tuple[int, int, int]:
+    *directory, name = path.rsplit(b"/", 1)
+    return (calculate_path_hash_reference(directory[0] if directory else b""),
+            calculate_path_hash_reference(name),
+            calculate_path_hash_reference(path))
+
+
+def __main__():
+    rnd = random.Random(0)
+    paths = [
+        f"chara/equipment/e{rnd.randrange(10000):04d}/texture/v{rnd.randrange(100):02d}_c0101e{rnd.randrange(10000):04d}"
+        f"_{rnd.choice(('top', 'dwn', 'sho', 'met', 'glv'))}_{rnd.choice('nmsd')}.tex".encode("utf-8")
+        for _ in range(100000)
+    ]
+
+    t = time.perf_counter()
+    expected = [split_hashes_reference(path) for path in paths]
+    reference_time = time.perf_counter() - t
+
+    t = time.perf_counter()
+    single = [(calculate_path_hash(path.rsplit(b"/", 1)[0]), calculate_path_hash(path.rsplit(b"/", 1)[1]),
+               calculate_path_hash(path)) for path in paths]
+    single_time = time.perf_counter() - t
+
+    t = time.perf_counter()
+    batch = calculate_path_hashes(paths)
+    batch_time = time.perf_counter() - t
+
+    assert single == expected
+    assert list(zip(*batch)) == expected
+
+    print(f"{len(paths)} paths, path/name/full path hashes each")
+    print(f"reference:             {reference_time * 1000:10.1f}ms")
+    print(f"calculate_path_hash:   {single_time * 1000:10.1f}ms ({reference_time / single_time:.1f}x)")
+    print(f"calculate_path_hashes: {batch_time * 1000:10.1f}ms ({reference_time / batch_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    exit(__main__())
@@ -0,0 +1,41 @@
+import json
+import statistics
+import subprocess
+import sys
+
+# Runs in a fresh interpreter each time, so that module imports and the page cache state of the interpreter itself are
+# part of the measurement, as they are for a command line invocation or a newly started worker.
+_CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+from pyxivdata.installation.resource_reader import GameResourceReader
+t1 = time.perf_counter()
+reader = GameResourceReader(sys.argv[1] or None)
+t2 = time.perf_counter()
+row = reader.get_excel_row(sys.argv[2], int(sys.argv[3]))
+t3 = time.perf_counter()
+print(json.dumps([t1 - t0, t2 - t1, t3 - t2, row is not None]))
+"""
+
+
+def __main__():
+    installation = sys.argv[1] if len(sys.argv) > 1 else ""
+    sheet = sys.argv[2] if len(sys.argv) > 2 else "Action"
+    row_id = sys.argv[3] if len(sys.argv) > 3 else "7"
+    runs = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", _CHILD, installation, sheet, row_id],
+                                check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output))
+
+    print(f"{runs} runs, {sheet}[{row_id}] found: {results[0][3]}")
+    for i, name in enumerate(("import", "construction", "first row")):
+        values = [x[i] * 1000 for x in results]
+        print(f"{name:14} median {statistics.median(values):8.2f}ms  min {min(values):8.2f}ms  "
+              f"max {max(values):8.2f}ms")
+
+
+if __name__ == "__main__":
+    exit(__main__())
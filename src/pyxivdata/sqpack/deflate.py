@@ -0,0 +1,115 @@
+import os
+import threading
+import typing
+import zlib
+
+# Inflates raw deflate data (no zlib header) that is known to decompress to the given number of bytes.
+InflateFunction = typing.Callable[[typing.Union[bytes, bytearray, memoryview], int], bytes]
+
+
+def _load_zlib() -> InflateFunction:
+    def inflate(data, decompressed_size):
+        return zlib.decompress(data, -zlib.MAX_WBITS, decompressed_size)
+
+    return inflate
+
+
+def _load_isal() -> InflateFunction:
+    from isal import isal_zlib
+
+    def inflate(data, decompressed_size):
+        return isal_zlib.decompress(data, -isal_zlib.MAX_WBITS, decompressed_size)
+
+    return inflate
+
+
+def _load_zlib_ng() -> InflateFunction:
+    from zlib_ng import zlib_ng
+
+    def inflate(data, decompressed_size):
+        return zlib_ng.decompress(data, -zlib_ng.MAX_WBITS, decompressed_size)
+
+    return inflate
+
+
+# Name -> function returning the inflate function of a backend; raises ImportError if the backend is unavailable.
+# Like zlib, the implementations must release the GIL while inflating for threaded decoding to scale.
+_BACKEND_LOADERS: typing.Dict[str, typing.Callable[[], InflateFunction]] = {
+    "zlib": _load_zlib,
+    "isal": _load_isal,
+    "zlib-ng": _load_zlib_ng,
+}
+
+# Backends tried in order by set_inflate_backend("auto").
+AUTO_BACKEND_ORDER = ("isal", "zlib-ng", "zlib")
+
+_backend_lock = threading.Lock()
+_backend_name = "zlib"
+_inflate: InflateFunction = _load_zlib()
+
+
+def _reset_backend_lock():
+    global _backend_lock
+    _backend_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_backend_lock)
+
+
+def register_inflate_backend(name: str, loader: typing.Callable[[], InflateFunction]):
+    with _backend_lock:
+        _BACKEND_LOADERS[name] = loader
+
+
+def get_inflate_backend_names() -> typing.List[str]:
+    return list(_BACKEND_LOADERS)
+
+
+def get_available_inflate_backend_names() -> typing.List[str]:
+    result = []
+    for name, loader in list(_BACKEND_LOADERS.items()):
+        try:
+            loader()
+        except ImportError:
+            continue
+        result.append(name)
+    return result
+
+
+def get_inflate_function(name: str) -> InflateFunction:
+    try:
+        loader = _BACKEND_LOADERS[name]
+    except KeyError:
+        raise KeyError(f"Unknown inflate backend {name!r}") from None
+    return loader()
+
+
+def get_inflate_backend() -> str:
+    return _backend_name
+
+
+def set_inflate_backend(name: str, fallback: bool = True) -> str:
+    # Selects the backend used for every sqpack block from now on, and returns the name of the one in use.
+    # With "auto", the first available backend in AUTO_BACKEND_ORDER is used. If the requested backend cannot be
+    # imported, zlib is used instead when fallback is set; otherwise ImportError propagates.
+    global _backend_name, _inflate
+
+    candidates = AUTO_BACKEND_ORDER if name == "auto" else (name,)
+    with _backend_lock:
+        for candidate in candidates:
+            try:
+                function = get_inflate_function(candidate)
+            except ImportError:
+                if not fallback and name != "auto":
+                    raise
+                continue
+            break
+        else:
+            candidate, function = "zlib", _load_zlib()
+        _backend_name, _inflate = candidate, function
+        return candidate
+
+
+def inflate(data: typing.Union[bytes, bytearray, memoryview], decompressed_size: int) -> bytes:
+    return _inflate(data, decompressed_size)
@@ -1,54 +1,159 @@
+import concurrent.futures
 import ctypes
 import io
+import os
+import threading
 import typing
-import zlib
 
+from pyxivdata.common import CorruptDataException
 from pyxivdata.resource.model.structures import ModelHeader
+from pyxivdata.sqpack import deflate
 from pyxivdata.sqpack.structures import SqDataFileEntryHeader, SqDataFileEntryType, SqDataBlockHeaderLocator, \
     SqDataBlockHeader, SqDataTextureBlockHeaderLocator, SqDataModelBlockLocator
 from pyxivdata.resource.texture.structure import TextureHeader
+from pyxivdata.util.file_pool import PooledFile
+
+# Entries decoding to less than this many bytes are always inflated on the calling thread.
+PARALLEL_DECODE_THRESHOLD = 0x100000
+
+# Number of blocks handed to an executor worker at once; a single 16KiB block is too little work for one task.
+PARALLEL_DECODE_BATCH_SIZE = 16
+
+_EntryData = typing.Union[bytearray, memoryview]
+
+
+# Serializes seek + readinto on platforms without positional reads (Windows).
+_seek_read_lock = threading.Lock()
+
+
+def read_at(fp: typing.Union[typing.BinaryIO, io.RawIOBase, PooledFile], offset: int, size: int) -> bytearray:
+    # Reads with os.preadv/os.pread where available, so that the file position is never touched and any number of
+    # threads may read from the same file object at once.
+    if isinstance(fp, PooledFile):
+        with fp.lease() as fp:
+            return read_at(fp, offset, size)
+
+    data = bytearray(size)
+    read = 0
+    if hasattr(os, "preadv"):
+        fd = fp.fileno()
+        view = memoryview(data)
+        while read < size:
+            chunk = os.preadv(fd, [view[read:]], offset + read)
+            if not chunk:
+                break
+            read += chunk
+    elif hasattr(os, "pread"):
+        fd = fp.fileno()
+        while read < size:
+            chunk = os.pread(fd, size - read, offset + read)
+            if not chunk:
+                break
+            data[read:read + len(chunk)] = chunk
+            read += len(chunk)
+    else:
+        with _seek_read_lock:
+            fp.seek(offset)
+            read = fp.readinto(data)
+    if read < size:
+        del data[read:]
+    return data
 
 
 def decode_entry(fp: typing.Union[typing.BinaryIO, io.RawIOBase], offset: int,
-                 read_size: typing.Optional[int] = None) -> bytearray:
-    fp.seek(offset)
+                 read_size: typing.Optional[int] = None,
+                 executor: typing.Optional[concurrent.futures.Executor] = None) -> bytearray:
     if read_size is None:
-        fp.readinto(header := SqDataFileEntryHeader())
+        header = SqDataFileEntryHeader.from_buffer(read_at(fp, offset, ctypes.sizeof(SqDataFileEntryHeader)))
         read_size = header.allocation_size + 0xFF
-    data = bytearray(read_size)
-    fp.readinto(data)
+    return decode_entry_data(read_at(fp, offset, read_size), executor)
+
+
+def decode_entry_data(data: _EntryData, executor: typing.Optional[concurrent.futures.Executor] = None) -> bytearray:
     header = SqDataFileEntryHeader.from_buffer_copy(data, 0)
     if header.type == SqDataFileEntryType.Empty:
         return bytearray()
     elif header.type == SqDataFileEntryType.Binary:
-        return decode_binary_entry(header, data)
+        return decode_binary_entry(header, data, executor)
     elif header.type == SqDataFileEntryType.Model:
-        return decode_model_entry(header, data)
+        return decode_model_entry(header, data, executor)
     elif header.type == SqDataFileEntryType.Texture:
-        return decode_texture_entry(header, data)
+        return decode_texture_entry(header, data, executor)
     else:
         raise AssertionError
 
 
-def decode_binary_entry(header: SqDataFileEntryHeader, data: bytearray) -> bytearray:
+def decode_block(data: _EntryData, offset: int = 0) -> typing.Union[bytes, _EntryData]:
+    block_header = SqDataBlockHeader.from_buffer(data, offset)
+    if block_header.is_compressed():
+        compressed = data[offset + block_header.header_size:
+                          offset + block_header.header_size + block_header.compressed_size]
+        if len(compressed) != block_header.compressed_size:
+            raise ValueError("Incomplete data")
+        d = deflate.inflate(compressed, block_header.decompressed_size)
+    else:
+        d = data[offset + block_header.header_size:][:block_header.decompressed_size]
+    if len(d) != block_header.decompressed_size:
+        raise CorruptDataException(f"Block at {offset} decoded to {len(d)} bytes, expected "
+                                   f"{block_header.decompressed_size} bytes")
+    return d
+
+
+def _decode_block_into(data: _EntryData, offset: int, result: memoryview, result_offset: int):
+    d = decode_block(data, offset)
+    result[result_offset:result_offset + len(d)] = d
+
+
+def _decode_block_batch_into(data: _EntryData, result: memoryview, blocks: typing.Sequence[typing.Tuple[int, int]]):
+    for offset, result_offset in blocks:
+        _decode_block_into(data, offset, result, result_offset)
+
+
+def _decode_blocks_into(data: _EntryData, blocks: typing.Sequence[typing.Tuple[int, int]], result: bytearray,
+                        executor: typing.Optional[concurrent.futures.Executor]):
+    # blocks is a sequence of (offset of SqDataBlockHeader in data, offset of decoded data in result).
+    # Inflate backends release the GIL while inflating, and each block writes to its own region of result, so the
+    # blocks can be decoded concurrently by a thread-based executor.
+    # The calling thread takes batches off the same queue as the workers, and tasks that have not started by the time
+    # the queue runs dry are cancelled instead of waited for. Decoding therefore never waits on a free worker, and does
+    # not deadlock when called from a task running on executor itself.
+    view = memoryview(result)
+    if executor is None or len(result) < PARALLEL_DECODE_THRESHOLD or len(blocks) <= PARALLEL_DECODE_BATCH_SIZE:
+        _decode_block_batch_into(data, view, blocks)
+        return
+
+    batches = iter([blocks[i:i + PARALLEL_DECODE_BATCH_SIZE]
+                    for i in range(0, len(blocks), PARALLEL_DECODE_BATCH_SIZE)])
+    batches_lock = threading.Lock()
+
+    def decode_batches():
+        while True:
+            with batches_lock:
+                batch = next(batches, None)
+            if batch is None:
+                return
+            _decode_block_batch_into(data, view, batch)
+
+    helper_count = min((len(blocks) - 1) // PARALLEL_DECODE_BATCH_SIZE, os.cpu_count() or 1)
+    futures = [executor.submit(decode_batches) for _ in range(helper_count)]
+    try:
+        decode_batches()
+    finally:
+        for future in futures:
+            if not future.cancel():
+                future.result()
+
+
+def get_binary_blocks(header: SqDataFileEntryHeader, data: _EntryData) -> typing.List[typing.Tuple[int, int, int]]:
+    # Returns (offset of block from the entry, stored size, decompressed size) for every block.
     locators = (SqDataBlockHeaderLocator * header.block_count_or_version).from_buffer(data, ctypes.sizeof(header))
-    result: typing.List[typing.Optional[bytes]] = [None] * len(locators)
-    for i, locator in enumerate(locators):
-        offset = header.header_size + locator.offset
-        block_header = SqDataBlockHeader.from_buffer(data, offset)
-        if block_header.is_compressed():
-            compressed = data[offset + block_header.header_size:
-                              offset + block_header.header_size + block_header.compressed_size]
-            if len(compressed) != block_header.compressed_size:
-                raise ValueError("Incomplete data")
-            result[i] = zlib.decompress(compressed, wbits=-zlib.MAX_WBITS, bufsize=block_header.decompressed_size)
-        else:
-            result[i] = data[offset + block_header.header_size:][:block_header.decompressed_size]
-
-    return bytearray().join(result)
-
-
-def decode_model_entry(header: SqDataFileEntryHeader, data: bytearray) -> bytearray:
+    return [(header.header_size + locator.offset, locator.block_size, locator.decompressed_data_size)
+            for locator in locators]
+
+
+def get_model_chunk_blocks(header: SqDataFileEntryHeader, data: _EntryData
+                           ) -> typing.Tuple[SqDataModelBlockLocator, typing.List[typing.List[typing.Tuple[int, int]]]]:
+    # Returns the locator, and (offset of block from the entry, stored size) for every block of every chunk.
     locator = SqDataModelBlockLocator.from_buffer(data, ctypes.sizeof(header))
     read_offset = ctypes.sizeof(header) + ctypes.sizeof(locator)
     block_sizes = [
@@ -56,6 +161,27 @@ def decode_model_entry(header: SqDataFileEntryHeader, data: bytearray) -> bytear
         for i in range(locator.first_block_indices.index[2] + locator.block_count.index[2])
     ]
 
+    result = []
+    for i in range(len(locator.block_count)):
+        offset = header.header_size + locator.first_block_offsets[i]
+        blocks = []
+        for block_index in range(locator.first_block_indices[i],
+                                 locator.first_block_indices[i] + locator.block_count[i]):
+            blocks.append((offset, block_sizes[block_index]))
+            offset += block_sizes[block_index]
+        result.append(blocks)
+    return locator, result
+
+
+def get_model_blocks(header: SqDataFileEntryHeader, data: _EntryData,
+                     get_decompressed_size: typing.Callable[[int], int],
+                     chunks: typing.Optional[typing.Container[int]] = None
+                     ) -> typing.Tuple[ModelHeader, typing.List[typing.Tuple[int, int, int]]]:
+    # Returns the ModelHeader to prepend, and (offset of block from the entry, stored size, offset in the decoded
+    # result) for every block. get_decompressed_size is called with the offset of each block from the entry.
+    # If chunks is given, chunks not in it are left out, and are described as empty in the ModelHeader.
+    locator, chunk_blocks = get_model_chunk_blocks(header, data)
+
     model_header = ModelHeader()
     model_header.version = header.block_count_or_version
     model_header.vertex_declaration_count = locator.vertex_declaration_count
@@ -67,23 +193,14 @@ def decode_model_entry(header: SqDataFileEntryHeader, data: bytearray) -> bytear
 
     blocks = []
     result_size = ctypes.sizeof(model_header)
-    for i in range(len(locator.block_count)):
-        if not locator.block_count[i]:
+    for i, chunk in enumerate(chunk_blocks):
+        if not chunk or (chunks is not None and i not in chunks):
             continue
 
         from_result_size = result_size
-        offset = header.header_size + locator.first_block_offsets[i]
-        for block_index in range(locator.first_block_indices[i],
-                                 locator.first_block_indices[i] + locator.block_count[i]):
-            block_header = SqDataBlockHeader.from_buffer(data, offset)
-            if block_header.is_compressed():
-                d = zlib.decompress(data[offset + block_header.header_size:][:block_header.compressed_size],
-                                    wbits=-zlib.MAX_WBITS, bufsize=block_header.decompressed_size)
-            else:
-                d = data[offset + block_header.header_size:][:block_header.decompressed_size]
-            blocks.append(d)
-            result_size += len(d)
-            offset += block_sizes[block_index]
+        for offset, stored_size in chunk:
+            blocks.append((offset, stored_size, result_size))
+            result_size += get_decompressed_size(offset)
         if i == 0:
             model_header.stack_memory_size = result_size - from_result_size
         elif i == 1:
@@ -95,11 +212,12 @@ def decode_model_entry(header: SqDataFileEntryHeader, data: bytearray) -> bytear
             model_header.index_buffer_size[(i - 4) // 3] = result_size - from_result_size
             model_header.index_data_offset[(i - 4) // 3] = from_result_size
 
-    # noinspection PyTypeChecker
-    return bytearray(model_header) + bytearray().join(blocks)
+    return model_header, blocks
 
 
-def decode_texture_entry(header: SqDataFileEntryHeader, data: bytearray) -> bytearray:
+def get_texture_mipmap_blocks(header: SqDataFileEntryHeader, data: _EntryData
+                              ) -> typing.List[typing.List[typing.Tuple[int, int]]]:
+    # Returns (offset of block from the entry, stored size) for every block of every mipmap.
     read_offset = ctypes.sizeof(header)
     locators = (SqDataTextureBlockHeaderLocator * header.block_count_or_version
                 ).from_buffer(data, read_offset)
@@ -110,28 +228,173 @@ def decode_texture_entry(header: SqDataFileEntryHeader, data: bytearray) -> byte
         for i in range(sum(locator.sub_block_count for locator in locators))
     ]
 
-    read_offset = header.header_size
-    texture_header = TextureHeader.from_buffer(data, read_offset)
+    result = []
+    for locator in locators:
+        offset = header.header_size + locator.first_block_offset
+        blocks = []
+        for sub_block_size in sub_block_sizes[locator.first_sub_block_index:][:locator.sub_block_count]:
+            blocks.append((offset, sub_block_size))
+            offset += sub_block_size
+        result.append(blocks)
+    return result
+
 
-    read_offset += ctypes.sizeof(texture_header)
-    mipmap_offsets = [
+def get_texture_mipmap_offsets(texture_header: TextureHeader, data: _EntryData, offset: int) -> typing.List[int]:
+    # offset points to texture_header within data.
+    read_offset = offset + ctypes.sizeof(texture_header)
+    return [
         int.from_bytes(data[read_offset + i * 4:][:4], "little", signed=False)
         for i in range(texture_header.mipmap_count)
     ]
 
-    result = bytearray(header.decompressed_size)
+
+def get_texture_decoded_size(header: SqDataFileEntryHeader, data: _EntryData,
+                             mipmap_offsets: typing.Sequence[int]) -> int:
+    # Mipmaps may end past the decompressed size in the entry header; the decoded texture covers both.
+    locators = (SqDataTextureBlockHeaderLocator * header.block_count_or_version
+                ).from_buffer(data, ctypes.sizeof(header))
+    return max([header.decompressed_size,
+                *(offset + locator.decompressed_size for offset, locator in zip(mipmap_offsets, locators))])
+
+
+def get_entry_block_count(header: SqDataFileEntryHeader, data: _EntryData) -> int:
+    # data must hold at least header.header_size bytes from the start of the entry.
+    if header.type == SqDataFileEntryType.Empty:
+        return 0
+    elif header.type == SqDataFileEntryType.Binary:
+        return header.block_count_or_version
+    elif header.type == SqDataFileEntryType.Model:
+        return sum(map(len, get_model_chunk_blocks(header, data)[1]))
+    elif header.type == SqDataFileEntryType.Texture:
+        return sum(map(len, get_texture_mipmap_blocks(header, data)))
+    else:
+        raise AssertionError
+
+
+def decode_binary_entry(header: SqDataFileEntryHeader, data: _EntryData,
+                        executor: typing.Optional[concurrent.futures.Executor] = None) -> bytearray:
+    blocks = []
+    result_size = 0
+    for offset, _, _ in get_binary_blocks(header, data):
+        blocks.append((offset, result_size))
+        result_size += SqDataBlockHeader.from_buffer(data, offset).decompressed_size
+
+    result = bytearray(result_size)
+    _decode_blocks_into(data, blocks, result, executor)
+    return result
+
+
+def decode_model_entry(header: SqDataFileEntryHeader, data: _EntryData,
+                       executor: typing.Optional[concurrent.futures.Executor] = None) -> bytearray:
+    model_header, blocks = get_model_blocks(
+        header, data, lambda offset: SqDataBlockHeader.from_buffer(data, offset).decompressed_size)
+
+    result_size = ctypes.sizeof(model_header)
+    if blocks:
+        result_size = blocks[-1][2] + SqDataBlockHeader.from_buffer(data, blocks[-1][0]).decompressed_size
+
+    result = bytearray(result_size)
+    result[0:ctypes.sizeof(model_header)] = bytes(model_header)
+    _decode_blocks_into(data, [(offset, result_offset) for offset, _, result_offset in blocks], result, executor)
+    return result
+
+
+def decode_texture_entry(header: SqDataFileEntryHeader, data: _EntryData,
+                         executor: typing.Optional[concurrent.futures.Executor] = None) -> bytearray:
+    mipmap_blocks = get_texture_mipmap_blocks(header, data)
+    texture_header = TextureHeader.from_buffer(data, header.header_size)
+    mipmap_offsets = get_texture_mipmap_offsets(texture_header, data, header.header_size)
+
+    blocks = []
+    result_size = get_texture_decoded_size(header, data, mipmap_offsets)
+    for mipmap_offset, mipmap in zip(mipmap_offsets, mipmap_blocks):
+        for offset, _ in mipmap:
+            blocks.append((offset, mipmap_offset))
+            mipmap_offset += SqDataBlockHeader.from_buffer(data, offset).decompressed_size
+        if mipmap_offset > result_size:
+            raise CorruptDataException("Texture mipmap blocks decompress to more than their locator says")
+
+    result = bytearray(result_size)
     result[0:texture_header.header_size] = data[header.header_size:header.header_size + texture_header.header_size]
-    for mipmap_offset, locator in zip(mipmap_offsets, locators):
-        offset = header.header_size + locator.first_block_offset
-        for sub_block_size in sub_block_sizes[locator.first_sub_block_index:][:locator.sub_block_count]:
-            block_header = SqDataBlockHeader.from_buffer(data, offset)
-            if block_header.is_compressed():
-                d = zlib.decompress(data[offset + block_header.header_size:][:block_header.compressed_size],
-                                    wbits=-zlib.MAX_WBITS, bufsize=block_header.decompressed_size)
-            else:
-                d = data[offset + block_header.header_size:][:block_header.decompressed_size]
-            result[mipmap_offset:mipmap_offset + len(d)] = d
-            offset += sub_block_size
-            mipmap_offset += len(d)
+    _decode_blocks_into(data, blocks, result, executor)
+    return result
+
+
+def decode_model_chunks(fp: typing.Union[typing.BinaryIO, io.RawIOBase], offset: int, chunks: typing.Iterable[int],
+                        executor: typing.Optional[concurrent.futures.Executor] = None) -> bytearray:
+    # Decodes a model like decode_model_entry, but only with the given chunks (see SqDataModelChunk). Only the blocks
+    # of those chunks are read and inflated.
+    header = SqDataFileEntryHeader.from_buffer(read_at(fp, offset, ctypes.sizeof(SqDataFileEntryHeader)))
+    if header.type != SqDataFileEntryType.Model:
+        raise ValueError(f"Entry at {offset} is not a model ({header.type})")
+
+    data = read_at(fp, offset, header.header_size)
+    chunks = set(chunks)
+    _, chunk_blocks = get_model_chunk_blocks(header, data)
+
+    # Blocks of a chunk are stored back to back.
+    sources: typing.Dict[int, typing.Tuple[bytearray, int]] = {}
+    for chunk in chunks:
+        blocks = chunk_blocks[chunk]
+        if not blocks:
+            continue
+        read_from = blocks[0][0]
+        chunk_data = read_at(fp, offset + read_from, blocks[-1][0] + blocks[-1][1] - read_from)
+        for block_offset, _ in blocks:
+            sources[block_offset] = chunk_data, block_offset - read_from
 
+    model_header, blocks = get_model_blocks(
+        header, data, lambda block_offset: SqDataBlockHeader.from_buffer(*sources[block_offset]).decompressed_size,
+        chunks)
+
+    result_size = ctypes.sizeof(model_header)
+    if blocks:
+        result_size = blocks[-1][2] + SqDataBlockHeader.from_buffer(*sources[blocks[-1][0]]).decompressed_size
+
+    result = bytearray(result_size)
+    result[0:ctypes.sizeof(model_header)] = bytes(model_header)
+    per_chunk: typing.Dict[int, typing.Tuple[bytearray, typing.List[typing.Tuple[int, int]]]] = {}
+    for block_offset, _, result_offset in blocks:
+        chunk_data, relative_offset = sources[block_offset]
+        per_chunk.setdefault(id(chunk_data), (chunk_data, []))[1].append((relative_offset, result_offset))
+    for chunk_data, chunk_blocks_into in per_chunk.values():
+        _decode_blocks_into(chunk_data, chunk_blocks_into, result, executor)
     return result
+
+
+def decode_texture_mipmaps(fp: typing.Union[typing.BinaryIO, io.RawIOBase], offset: int,
+                           mipmap_indices: typing.Iterable[int],
+                           executor: typing.Optional[concurrent.futures.Executor] = None
+                           ) -> typing.Tuple[bytearray, typing.List[bytearray]]:
+    # Returns the texture header (along with the mipmap offset table following it) and the data of each requested
+    # mipmap. Only the blocks of the requested mipmaps are read and inflated.
+    header = SqDataFileEntryHeader.from_buffer(read_at(fp, offset, ctypes.sizeof(SqDataFileEntryHeader)))
+    if header.type != SqDataFileEntryType.Texture:
+        raise ValueError(f"Entry at {offset} is not a texture ({header.type})")
+
+    data = read_at(fp, offset, header.header_size + ctypes.sizeof(TextureHeader))
+    texture_header = TextureHeader.from_buffer(data, header.header_size)
+    texture_header_data = read_at(fp, offset + header.header_size, texture_header.header_size)
+    mipmap_blocks = get_texture_mipmap_blocks(header, data)
+
+    mipmaps = []
+    for mipmap_index in mipmap_indices:
+        blocks = mipmap_blocks[mipmap_index]
+        if not blocks:
+            mipmaps.append(bytearray())
+            continue
+
+        # Blocks of a mipmap are stored back to back.
+        read_from = blocks[0][0]
+        mipmap_data = read_at(fp, offset + read_from, blocks[-1][0] + blocks[-1][1] - read_from)
+        decode_blocks = []
+        mipmap_size = 0
+        for block_offset, _ in blocks:
+            decode_blocks.append((block_offset - read_from, mipmap_size))
+            mipmap_size += SqDataBlockHeader.from_buffer(mipmap_data, block_offset - read_from).decompressed_size
+
+        mipmap = bytearray(mipmap_size)
+        _decode_blocks_into(mipmap_data, decode_blocks, mipmap, executor)
+        mipmaps.append(mipmap)
+
+    return texture_header_data, mipmaps
@@ -0,0 +1,186 @@
+import collections
+import ctypes
+import io
+import typing
+from bisect import bisect_right
+
+from pyxivdata.common import CorruptDataException
+from pyxivdata.sqpack.entry_decoder import read_at, decode_block, get_binary_blocks, get_model_blocks, \
+    get_texture_mipmap_blocks, get_texture_mipmap_offsets, get_texture_decoded_size
+from pyxivdata.sqpack.structures import SqDataFileEntryHeader, SqDataFileEntryType, SqDataBlockHeader
+from pyxivdata.resource.texture.structure import TextureHeader
+
+
+class _BlockRun:
+    # A run of blocks decoding to consecutive bytes starting from decoded_offset.
+    # ends[i] is the end of block i relative to decoded_offset; it is filled lazily when the decompressed sizes are not
+    # known from the entry header.
+
+    def __init__(self, decoded_offset: int, blocks: typing.List[typing.Tuple[int, int]],
+                 decompressed_sizes: typing.Optional[typing.Iterable[int]] = None):
+        self.decoded_offset = decoded_offset
+        self.blocks = blocks
+        self.ends: typing.List[int] = []
+        if decompressed_sizes is not None:
+            end = 0
+            for size in decompressed_sizes:
+                end += size
+                self.ends.append(end)
+
+
+class SqpackEntryStream(io.RawIOBase):
+    def __init__(self, fp: typing.Union[typing.BinaryIO, io.RawIOBase], offset: int, block_cache_size: int = 4):
+        super().__init__()
+        self._fp = fp
+        self._offset = offset
+        self._position = 0
+        self._block_cache: typing.OrderedDict[typing.Tuple[int, int], bytes] = collections.OrderedDict()
+        self._block_cache_size = block_cache_size
+        self._prefix = b""
+        self._runs: typing.List[_BlockRun] = []
+
+        header = SqDataFileEntryHeader.from_buffer(read_at(fp, offset, ctypes.sizeof(SqDataFileEntryHeader)))
+        self._header = header
+        self._size: typing.Optional[int] = 0
+        self._run_offsets: typing.List[int] = []
+        self._entry_header_data: typing.Optional[bytearray] = None
+        if header.type == SqDataFileEntryType.Empty:
+            return
+
+        data = read_at(fp, offset, header.header_size)
+        if header.type == SqDataFileEntryType.Binary:
+            blocks = get_binary_blocks(header, data)
+            self._runs.append(_BlockRun(0, [(offset, stored_size) for offset, stored_size, _ in blocks],
+                                        (decompressed_size for _, _, decompressed_size in blocks)))
+            self._size = self._runs[0].ends[-1] if blocks else 0
+
+        elif header.type == SqDataFileEntryType.Model:
+            # The ModelHeader at the start of the decoded data holds the decoded size of every chunk, which takes the
+            # header of every block to work out; that waits until the stream is first read from or measured.
+            self._entry_header_data = data
+            self._size = None
+            return
+
+        elif header.type == SqDataFileEntryType.Texture:
+            texture_header = TextureHeader.from_buffer(read_at(fp, offset + header.header_size,
+                                                               ctypes.sizeof(TextureHeader)))
+            self._prefix = bytes(read_at(fp, offset + header.header_size, texture_header.header_size))
+            mipmap_offsets = get_texture_mipmap_offsets(texture_header, self._prefix, 0)
+            for mipmap_offset, blocks in zip(mipmap_offsets, get_texture_mipmap_blocks(header, data)):
+                self._runs.append(_BlockRun(mipmap_offset, blocks))
+            self._size = get_texture_decoded_size(header, data, mipmap_offsets)
+
+        else:
+            raise AssertionError
+
+        self._runs.sort(key=lambda x: x.decoded_offset)
+        self._run_offsets = [run.decoded_offset for run in self._runs]
+
+    def _load_model_layout(self):
+        decompressed_sizes = {}
+
+        def get_decompressed_size(block_offset: int) -> int:
+            decompressed_sizes[block_offset] = self._read_block_header(block_offset).decompressed_size
+            return decompressed_sizes[block_offset]
+
+        model_header, blocks = get_model_blocks(self._header, self._entry_header_data, get_decompressed_size)
+        self._prefix = bytes(model_header)
+        self._runs = [_BlockRun(len(self._prefix), [(offset, stored_size) for offset, stored_size, _ in blocks],
+                                (decompressed_sizes[offset] for offset, _, _ in blocks))]
+        self._run_offsets = [len(self._prefix)]
+        self._size = len(self._prefix) + (self._runs[0].ends[-1] if blocks else 0)
+        self._entry_header_data = None
+
+    @property
+    def header(self) -> SqDataFileEntryHeader:
+        return self._header
+
+    @property
+    def size(self) -> int:
+        if self._size is None:
+            self._load_model_layout()
+        return self._size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+        if position < 0:
+            raise ValueError(f"negative seek position {position}")
+        self._position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast("B")
+        size = min(len(view), max(0, self.size - self._position))
+        written = 0
+        while written < size:
+            chunk = self._read_chunk(self._position + written, size - written)
+            if not chunk:
+                raise CorruptDataException(f"No data for offset {self._position + written} of {self._size}")
+            view[written:written + len(chunk)] = chunk
+            written += len(chunk)
+        self._position += written
+        return written
+
+    def _read_block_header(self, block_offset: int) -> SqDataBlockHeader:
+        return SqDataBlockHeader.from_buffer(read_at(self._fp, self._offset + block_offset,
+                                                     ctypes.sizeof(SqDataBlockHeader)))
+
+    def _read_block(self, run_index: int, block_index: int) -> bytes:
+        key = run_index, block_index
+        data = self._block_cache.get(key)
+        if data is not None:
+            self._block_cache.move_to_end(key)
+            return data
+
+        block_offset, stored_size = self._runs[run_index].blocks[block_index]
+        data = bytes(decode_block(read_at(self._fp, self._offset + block_offset, stored_size)))
+        self._block_cache[key] = data
+        while len(self._block_cache) > self._block_cache_size:
+            self._block_cache.popitem(last=False)
+        return data
+
+    def _find_block(self, run: _BlockRun, position: int) -> typing.Optional[int]:
+        relative_position = position - run.decoded_offset
+        while not run.ends or run.ends[-1] <= relative_position:
+            if len(run.ends) == len(run.blocks):
+                return None
+            block_offset, _ = run.blocks[len(run.ends)]
+            run.ends.append((run.ends[-1] if run.ends else 0)
+                            + self._read_block_header(block_offset).decompressed_size)
+        return bisect_right(run.ends, relative_position)
+
+    def _read_chunk(self, position: int, max_size: int) -> typing.Union[bytes, memoryview]:
+        if position < len(self._prefix):
+            return memoryview(self._prefix)[position:position + max_size]
+
+        run_index = bisect_right(self._run_offsets, position) - 1
+        if run_index >= 0:
+            run = self._runs[run_index]
+            block_index = self._find_block(run, position)
+            if block_index is not None:
+                block_start = run.decoded_offset + (run.ends[block_index - 1] if block_index else 0)
+                data = self._read_block(run_index, block_index)
+                return memoryview(data)[position - block_start:position - block_start + max_size]
+
+        # Not covered by any block; happens with padding between texture mipmaps.
+        if run_index + 1 < len(self._runs):
+            gap_end = self._runs[run_index + 1].decoded_offset
+        else:
+            gap_end = self._size
+        return bytes(min(max_size, gap_end - position))
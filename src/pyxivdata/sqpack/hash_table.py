@@ -0,0 +1,134 @@
+import array
+import ctypes
+import sys
+import typing
+from bisect import bisect_left
+
+from pyxivdata.sqpack.structures import SqIndexPairHashLocator, SqIndexFullHashLocator, \
+    SqIndexPairHashWithTextLocator, SqIndexFullHashWithTextLocator
+
+
+def as_uint32_words(data: typing.Union[ctypes.Array, bytes, bytearray, memoryview]) -> typing.Sequence[int]:
+    view = memoryview(data).cast("B")
+    if sys.byteorder == "little":
+        return view.cast("I")
+    words = array.array("I")
+    words.frombytes(view)
+    words.byteswap()
+    return words
+
+
+def pair_hash_key(path_hash: int, name_hash: int) -> int:
+    return (path_hash << 32) | name_hash
+
+
+def sort_by_keys(keys: array.array, values: array.array) -> typing.Tuple[array.array, array.array]:
+    # Sorts both by key, keeping the order of equal keys. Index files already store their locators in hash order, so
+    # for those this normally returns the arrays as they are.
+    if all(a <= b for a, b in zip(keys, keys[1:])):
+        return keys, values
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    return array.array(keys.typecode, map(keys.__getitem__, order)), array.array(values.typecode,
+                                                                                 map(values.__getitem__, order))
+
+
+def pair_hash_synonyms(
+        text_locators: typing.Union[ctypes.Array[SqIndexPairHashWithTextLocator],
+                                    typing.Sequence[SqIndexPairHashWithTextLocator]]
+) -> typing.Dict[int, typing.Dict[str, int]]:
+    synonyms = {}
+    for f in text_locators:
+        if f.name_hash == f.SENTINEL and f.path_hash == f.SENTINEL and f.conflict_index == f.SENTINEL:
+            break
+        synonyms.setdefault(pair_hash_key(f.path_hash, f.name_hash), {})[f.full_path.lower()] = f.locator.value
+    return synonyms
+
+
+def full_path_hash_synonyms(
+        text_locators: typing.Union[ctypes.Array[SqIndexFullHashWithTextLocator],
+                                    typing.Sequence[SqIndexFullHashWithTextLocator]]
+) -> typing.Dict[int, typing.Dict[str, int]]:
+    synonyms = {}
+    for f in text_locators:
+        if f.full_path_hash == f.SENTINEL and f.unused_hash == f.SENTINEL and f.conflict_index == f.SENTINEL:
+            break
+        synonyms.setdefault(f.full_path_hash, {})[f.full_path.lower()] = f.locator.value
+    return synonyms
+
+
+class SqIndexHashTable:
+    # Keys are either full path hashes or pair_hash_key(path_hash, name_hash); values are raw SqIndexDataLocator
+    # values. Entries with the synonym bit set need to be resolved with get_synonym.
+    # Keys must be sorted; lookups bisect them, so that tables used straight from a mapped cache file cost nothing to
+    # set up.
+
+    def __init__(self, keys: typing.Sequence[int], values: typing.Sequence[int],
+                 synonyms: typing.Optional[typing.Dict[int, typing.Dict[str, int]]] = None):
+        if len(keys) != len(values):
+            raise ValueError("keys and values must have the same length")
+        self._keys = keys
+        self._values = values
+        self._synonyms = synonyms or {}
+
+    @classmethod
+    def from_pair_hash_locators(
+            cls,
+            locators: typing.Union[ctypes.Array[SqIndexPairHashLocator], typing.Sequence[SqIndexPairHashLocator]],
+            text_locators: typing.Union[ctypes.Array[SqIndexPairHashWithTextLocator],
+                                        typing.Sequence[SqIndexPairHashWithTextLocator]]):
+        words = as_uint32_words(locators)
+        keys, values = sort_by_keys(array.array("Q", map(pair_hash_key, words[1::4], words[0::4])),
+                                    array.array("I", words[2::4]))
+
+        return cls(keys, values, pair_hash_synonyms(text_locators))
+
+    @classmethod
+    def from_full_path_hash_locators(
+            cls,
+            locators: typing.Union[ctypes.Array[SqIndexFullHashLocator], typing.Sequence[SqIndexFullHashLocator]],
+            text_locators: typing.Union[ctypes.Array[SqIndexFullHashWithTextLocator],
+                                        typing.Sequence[SqIndexFullHashWithTextLocator]]):
+        words = as_uint32_words(locators)
+        keys, values = sort_by_keys(array.array("Q", words[0::2]), array.array("I", words[1::2]))
+
+        return cls(keys, values, full_path_hash_synonyms(text_locators))
+
+    def _find(self, key: int) -> int:
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return i
+        return -1
+
+    @property
+    def keys(self) -> typing.Sequence[int]:
+        return self._keys
+
+    @property
+    def values(self) -> typing.Sequence[int]:
+        return self._values
+
+    @property
+    def synonyms(self) -> typing.Dict[int, typing.Dict[str, int]]:
+        return self._synonyms
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key: int) -> bool:
+        return self._find(key) != -1
+
+    def __getitem__(self, key: int) -> int:
+        i = self._find(key)
+        if i == -1:
+            raise KeyError(key)
+        return self._values[i]
+
+    def get(self, key: int, default: typing.Optional[int] = None) -> typing.Optional[int]:
+        i = self._find(key)
+        return default if i == -1 else self._values[i]
+
+    def get_many(self, keys: typing.Iterable[int]) -> typing.List[typing.Optional[int]]:
+        return list(map(self.get, keys))
+
+    def get_synonym(self, key: int, full_path: str) -> typing.Optional[int]:
+        return self._synonyms.get(key, {}).get(full_path.lower())
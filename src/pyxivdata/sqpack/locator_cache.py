@@ -0,0 +1,29 @@
+import hashlib
+import sys
+import typing
+
+from pyxivdata.util.section_file import SectionFile
+
+if typing.TYPE_CHECKING:
+    from pyxivdata.sqpack.reader import SqIndexReader
+
+
+class SqLocatorCache(SectionFile):
+    SIGNATURE: typing.ClassVar[bytes] = b"XIVSQLCH"
+    VERSION: typing.ClassVar[int] = 3
+
+
+def get_locator_cache_key(index: 'SqIndexReader', data_sizes: typing.Iterable[int]) -> bytes:
+    # The raw headers carry the SHA-1 of the headers themselves and of every segment, along with segment offsets and
+    # sizes; data file sizes and the byte order of the cached arrays complete the key.
+    h = hashlib.sha1()
+    h.update(SqLocatorCache.SIGNATURE)
+    h.update(SqLocatorCache.VERSION.to_bytes(4, "little"))
+    h.update(sys.byteorder.encode("utf-8"))
+    h.update(bytes(index.header1))
+    h.update(bytes(index.index1))
+    h.update(bytes(index.header2))
+    h.update(bytes(index.index2))
+    for size in data_sizes:
+        h.update(size.to_bytes(8, "little"))
+    return h.digest()
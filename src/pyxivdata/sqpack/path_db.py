@@ -0,0 +1,126 @@
+import array
+import hashlib
+import os
+import pathlib
+import typing
+from bisect import bisect_left
+
+from pyxivdata.common import SqPathSpec, calculate_path_hashes
+from pyxivdata.sqpack.hash_table import pair_hash_key
+from pyxivdata.util.section_file import SectionFile
+
+
+def read_path_list(path: typing.Union[str, os.PathLike]) -> typing.Iterator[str]:
+    # One path per line; blank lines and lines starting with # are skipped.
+    with pathlib.Path(path).open("r", encoding="utf-8") as fp:
+        for line in fp:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+
+class SqPathDatabase(SectionFile):
+    # Known full paths, stored as one UTF-8 blob and two sorted hash -> path index tables. Lookups bisect the mapped
+    # tables, so only the paths that are actually looked up become Python strings.
+    SIGNATURE: typing.ClassVar[bytes] = b"XIVPATHS"
+    VERSION: typing.ClassVar[int] = 1
+
+    def __init__(self, path: typing.Union[str, os.PathLike]):
+        super().__init__(path)
+        try:
+            self._strings = self["strings"]
+            self._string_offsets = self["string_offsets"]
+            self._full_path_hash_keys = self["full_path_hash_keys"]
+            self._full_path_hash_indices = self["full_path_hash_indices"]
+            self._pair_hash_keys = self["pair_hash_keys"]
+            self._pair_hash_indices = self["pair_hash_indices"]
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._strings = self._string_offsets = None
+        self._full_path_hash_keys = self._full_path_hash_indices = None
+        self._pair_hash_keys = self._pair_hash_indices = None
+        super().close()
+
+    @classmethod
+    def build(cls, path: typing.Union[str, os.PathLike], paths: typing.Iterable[typing.Union[str, SqPathSpec]]):
+        # Paths differing only in letter case are stored once, keeping the first seen.
+        unique: typing.Dict[str, str] = {}
+        for item in paths:
+            spec = SqPathSpec(item)
+            if not spec.has_full_path():
+                raise ValueError(f"{spec} has no full path to store")
+            item = spec.full_path
+            if not item.endswith("/"):
+                unique.setdefault(item.lower(), item)
+        full_paths = sorted(unique.values())
+
+        strings = bytearray()
+        string_offsets = array.array("Q", [0])
+        for item in full_paths:
+            strings += item.encode("utf-8")
+            string_offsets.append(len(strings))
+
+        path_hashes, name_hashes, full_path_hashes = calculate_path_hashes(full_paths)
+        full_path_hash_order = sorted(range(len(full_paths)), key=full_path_hashes.__getitem__)
+        pair_hash_keys = array.array("Q", map(pair_hash_key, path_hashes, name_hashes))
+        pair_hash_order = sorted(range(len(full_paths)), key=pair_hash_keys.__getitem__)
+
+        cls.write(path, hashlib.sha1(strings).digest(), {
+            "strings": memoryview(strings),
+            "string_offsets": string_offsets,
+            "full_path_hash_keys": array.array("I", (full_path_hashes[i] for i in full_path_hash_order)),
+            "full_path_hash_indices": array.array("I", full_path_hash_order),
+            "pair_hash_keys": array.array("Q", (pair_hash_keys[i] for i in pair_hash_order)),
+            "pair_hash_indices": array.array("I", pair_hash_order),
+        })
+
+    def __len__(self):
+        return len(self._string_offsets) - 1
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return (self._get_string(i) for i in range(len(self)))
+
+    def __contains__(self, item: typing.Union[str, bytes, os.PathLike, SqPathSpec]) -> bool:
+        item = SqPathSpec(item)
+        return item.full_path.lower() in (x.lower() for x in self.get_by_full_path_hash(item.full_path_hash))
+
+    def _get_string(self, index: int) -> str:
+        return bytes(self._strings[self._string_offsets[index]:self._string_offsets[index + 1]]).decode("utf-8")
+
+    @staticmethod
+    def _find(keys: memoryview, indices: memoryview, key: int) -> typing.Iterator[int]:
+        i = bisect_left(keys, key)
+        while i < len(keys) and keys[i] == key:
+            yield indices[i]
+            i += 1
+
+    def get_by_full_path_hash(self, full_path_hash: int) -> typing.List[str]:
+        return [self._get_string(i)
+                for i in self._find(self._full_path_hash_keys, self._full_path_hash_indices, full_path_hash)]
+
+    def get_by_pair_hash(self, path_hash: int, name_hash: int) -> typing.List[str]:
+        return [self._get_string(i)
+                for i in self._find(self._pair_hash_keys, self._pair_hash_indices, pair_hash_key(path_hash, name_hash))]
+
+    def resolve(self, item: SqPathSpec) -> SqPathSpec:
+        # Returns a spec with the full path if item has none and a known path has the same hashes; otherwise item.
+        if item.has_full_path():
+            return item
+        if item.has_path_name_hash():
+            candidates = self.get_by_pair_hash(item.path_hash, item.name_hash)
+        elif item.has_full_path_hash():
+            candidates = self.get_by_full_path_hash(item.full_path_hash)
+        else:
+            candidates = []
+        if not candidates:
+            return item
+        return SqPathSpec(candidates[0]).intern()
@@ -1,114 +1,193 @@
+import array
+import concurrent.futures
 import contextlib
 import ctypes
 import functools
 import io
+import mmap
 import os
 import pathlib
+import sys
 import typing
 from bisect import bisect_left
 
 from pyxivdata.common import CorruptDataException, SqPathSpec
-from pyxivdata.sqpack.entry_decoder import decode_entry
+from pyxivdata.resource.texture.structure import TextureHeader
+from pyxivdata.sqpack.entry_decoder import decode_entry, decode_entry_data, decode_model_chunks, \
+    decode_texture_mipmaps, get_entry_block_count, read_at
+from pyxivdata.sqpack.entry_stream import SqpackEntryStream
+from pyxivdata.sqpack.hash_table import SqIndexHashTable, as_uint32_words, pair_hash_key, pair_hash_synonyms, \
+    full_path_hash_synonyms
+from pyxivdata.sqpack.locator_cache import SqLocatorCache, get_locator_cache_key
+from pyxivdata.sqpack.path_db import SqPathDatabase
 from pyxivdata.sqpack.structures import SqIndexHeader, SqpackHeader, SqIndexPathHashLocator, SqIndexPairHashLocator, \
     SqIndexFullHashLocator, SqIndexDataLocator, SqIndexPairHashWithTextLocator, \
-    SqIndexFullHashWithTextLocator
+    SqIndexFullHashWithTextLocator, SqIndexSegmentDescriptor, SqDataFileEntryHeader, SqDataFileEntryType
+from pyxivdata.util.file_pool import FilePool, PooledFile
+from pyxivdata.util.lru_cache import LruCache
+from pyxivdata.util.section_file import get_location_tag, remove_stale_files
 
+_T = typing.TypeVar("_T", bound=ctypes.Structure)
 
-class SqIndexReader(typing.ContextManager):
-    _fp1: typing.Union[io.RawIOBase, typing.BinaryIO]
-    _fp2: typing.Union[io.RawIOBase, typing.BinaryIO]
 
-    def __init__(self, index1: typing.Union[str, os.PathLike], index2: typing.Union[str, os.PathLike]):
-        self._fp1 = pathlib.Path(index1).open("rb")
-        self._fp2 = pathlib.Path(index2).open("rb")
+def _map_file(fp: typing.Union[io.RawIOBase, typing.BinaryIO]) -> mmap.mmap:
+    if sys.version_info >= (3, 13):
+        # Otherwise the mapping keeps a duplicate of the file descriptor open for as long as it lives.
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_COPY, trackfd=False)
+    return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_COPY)
+
+
+def _stored_size_order(locator_value: int) -> int:
+    # Dat index is in bits 1-3, and offset / 8 is in bits 4-31.
+    return ((locator_value & 0xE) << 32) | locator_value
+
+
+class SqIndexReader(typing.ContextManager):
+    _fp1: typing.Union[io.RawIOBase, typing.BinaryIO, PooledFile, None] = None
+    _fp2: typing.Union[io.RawIOBase, typing.BinaryIO, PooledFile, None] = None
+    _mmap1: typing.Optional[mmap.mmap] = None
+    _mmap2: typing.Optional[mmap.mmap] = None
+
+    _MAPPED_PROPERTIES: typing.ClassVar[typing.Tuple[str, ...]] = (
+        "pair_hash_locators",
+        "full_path_hash_locators",
+        "pair_hash_with_text_locators",
+        "full_path_hash_with_text_locators",
+        "path_hash_locators",
+        "pair_hash_table",
+        "full_path_hash_table",
+    )
+
+    def __init__(self, index1: typing.Union[str, os.PathLike], index2: typing.Union[str, os.PathLike],
+                 use_mmap: bool = False, file_pool: typing.Optional[FilePool] = None):
+        # Index files are read through file_pool if given, so that they count towards its limit of open files.
+        # Mapped index files need no file object once mapped, and are closed right away.
+        index1 = pathlib.Path(index1)
+        index2 = pathlib.Path(index2)
         try:
-            self.header1 = SqpackHeader()
-            self._fp1.readinto(self.header1)
-            if self.header1.header_size != ctypes.sizeof(self.header1):
-                raise CorruptDataException(f"1.SqpackHeader.header_size != {ctypes.sizeof(self.header1)}")
-
-            self._fp1.seek(self.header1.header_size)
-            self.index1 = SqIndexHeader()
-            self._fp1.readinto(self.index1)
-            if self.index1.header_size != ctypes.sizeof(self.index1):
-                raise CorruptDataException(f"1.SqIndexHeader.header_size != {ctypes.sizeof(self.index1)}")
-
-            self.header2 = SqpackHeader()
-            self._fp2.readinto(self.header2)
-            if self.header2.header_size != ctypes.sizeof(self.header2):
-                raise CorruptDataException(f"2.SqpackHeader.header_size != {ctypes.sizeof(self.header2)}")
-
-            self._fp2.seek(self.header2.header_size)
-            self.index2 = SqIndexHeader()
-            self._fp2.readinto(self.index2)
-            if self.index2.header_size != ctypes.sizeof(self.index2):
-                raise CorruptDataException(f"2.SqIndexHeader.header_size != {ctypes.sizeof(self.index2)}")
+            self._fp1 = index1.open("rb") if file_pool is None or use_mmap else file_pool.get(index1)
+            self._fp2 = index2.open("rb") if file_pool is None or use_mmap else file_pool.get(index2)
+
+            self.header1 = self._read_header(self._fp1, 0, SqpackHeader, "1.SqpackHeader")
+            self.index1 = self._read_header(self._fp1, self.header1.header_size, SqIndexHeader, "1.SqIndexHeader")
+            self.header2 = self._read_header(self._fp2, 0, SqpackHeader, "2.SqpackHeader")
+            self.index2 = self._read_header(self._fp2, self.header2.header_size, SqIndexHeader, "2.SqIndexHeader")
+
+            if use_mmap:
+                # ctypes.from_buffer needs a writable buffer; a copy-on-write mapping is never written to, so its
+                # pages stay shared with the page cache (and with every other process mapping the same file).
+                self._mmap1 = _map_file(self._fp1)
+                self._mmap2 = _map_file(self._fp2)
+                self._close_files()
 
         except BaseException:
-            if self._fp1 is not None:
-                self._fp1.close()
-            if self._fp2 is not None:
-                self._fp2.close()
+            self._close_mmaps()
+            self._close_files()
             raise
 
+    @staticmethod
+    def _read_header(fp: typing.Union[io.RawIOBase, typing.BinaryIO, PooledFile], offset: int,
+                     struct_type: typing.Type[_T], name: str) -> _T:
+        data = read_at(fp, offset, ctypes.sizeof(struct_type))
+        data += bytes(ctypes.sizeof(struct_type) - len(data))
+        result = struct_type.from_buffer(data)
+        if result.header_size != ctypes.sizeof(struct_type):
+            raise CorruptDataException(f"{name}.header_size != {ctypes.sizeof(struct_type)}")
+        return result
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._fp1.close()
-        self._fp2.close()
+        self._close_mmaps()
+        self._close_files()
+
+    def _close_files(self):
+        for fp in (self._fp1, self._fp2):
+            if fp is not None:
+                fp.close()
+        self._fp1 = self._fp2 = None
+
+    def _close_mmaps(self):
+        for name in self._MAPPED_PROPERTIES:
+            self.__dict__.pop(name, None)
+
+        for mm in (self._mmap1, self._mmap2):
+            if mm is None:
+                continue
+            try:
+                mm.close()
+            except BufferError:
+                # Someone is still holding onto a view; the mapping goes away along with the last view.
+                pass
+        self._mmap1 = self._mmap2 = None
+
+    @property
+    def is_mmap(self) -> bool:
+        return self._mmap1 is not None
+
+    def _read_segment(self, index: int, segment: SqIndexSegmentDescriptor, struct_type: typing.Type[_T]
+                      ) -> typing.Union[ctypes.Array[_T], typing.Sequence[_T]]:
+        array_type = struct_type * (segment.size // ctypes.sizeof(struct_type))
+        mm = self._mmap1 if index == 1 else self._mmap2
+        if mm is not None:
+            return array_type.from_buffer(mm, segment.offset)
+
+        fp = self._fp1 if index == 1 else self._fp2
+        data = read_at(fp, segment.offset, ctypes.sizeof(array_type))
+        if len(data) != ctypes.sizeof(array_type):
+            raise CorruptDataException(f"{index}.{struct_type.__name__} segment is truncated")
+        return array_type.from_buffer(data)
+
+    def _read_segment_bytes(self, index: int, segment: SqIndexSegmentDescriptor) -> bytes:
+        mm = self._mmap1 if index == 1 else self._mmap2
+        if mm is not None:
+            return mm[segment.offset:segment.offset + segment.size]
+
+        fp = self._fp1 if index == 1 else self._fp2
+        return bytes(read_at(fp, segment.offset, segment.size))
 
     @functools.cached_property
     def pair_hash_locators(self) -> typing.Union[ctypes.Array[SqIndexPairHashLocator],
                                                  typing.Sequence[SqIndexPairHashLocator]]:
-        self._fp1.seek(self.index1.hash_locator_segment.offset)
-        data = self._fp1.read(self.index1.hash_locator_segment.size)
-        return (SqIndexPairHashLocator * (len(data) // ctypes.sizeof(SqIndexPairHashLocator))
-                ).from_buffer_copy(data)
+        return self._read_segment(1, self.index1.hash_locator_segment, SqIndexPairHashLocator)
 
     @functools.cached_property
     def full_path_hash_locators(self) -> typing.Union[ctypes.Array[SqIndexFullHashLocator],
                                                       typing.Sequence[SqIndexFullHashLocator]]:
-        self._fp2.seek(self.index2.hash_locator_segment.offset)
-        data = (SqIndexFullHashLocator *
-                (self.index2.hash_locator_segment.size // ctypes.sizeof(SqIndexFullHashLocator)))()
-        self._fp2.readinto(data)
-        return data
+        return self._read_segment(2, self.index2.hash_locator_segment, SqIndexFullHashLocator)
 
     @functools.cached_property
     def pair_hash_with_text_locators(self) -> typing.Union[ctypes.Array[SqIndexPairHashWithTextLocator],
                                                            typing.Sequence[SqIndexPairHashWithTextLocator]]:
-        self._fp1.seek(self.index1.text_locator_segment.offset)
-        data = self._fp1.read(self.index1.text_locator_segment.size)
-        return (SqIndexPairHashWithTextLocator * (len(data) // ctypes.sizeof(SqIndexPairHashWithTextLocator))
-                ).from_buffer_copy(data)
+        return self._read_segment(1, self.index1.text_locator_segment, SqIndexPairHashWithTextLocator)
 
     @functools.cached_property
     def full_path_hash_with_text_locators(self) -> typing.Union[ctypes.Array[SqIndexFullHashWithTextLocator],
                                                                 typing.Sequence[SqIndexFullHashWithTextLocator]]:
-        self._fp2.seek(self.index2.text_locator_segment.offset)
-        data = (SqIndexFullHashWithTextLocator * (self.index2.text_locator_segment.size //
-                                                  ctypes.sizeof(SqIndexFullHashWithTextLocator)))()
-        self._fp2.readinto(data)
-        return data
+        return self._read_segment(2, self.index2.text_locator_segment, SqIndexFullHashWithTextLocator)
 
     @functools.cached_property
     def index1_unknown_segment_3(self) -> bytes:
-        self._fp1.seek(self.index1.unknown_segment_3.offset)
-        return self._fp1.read(self.index1.unknown_segment_3.size)
+        return self._read_segment_bytes(1, self.index1.unknown_segment_3)
 
     @functools.cached_property
     def index2_unknown_segment_3(self) -> bytes:
-        self._fp2.seek(self.index1.unknown_segment_3.offset)
-        return self._fp2.read(self.index2.unknown_segment_3.size)
+        return self._read_segment_bytes(2, self.index2.unknown_segment_3)
 
     @functools.cached_property
     def path_hash_locators(self) -> typing.Union[ctypes.Array[SqIndexPathHashLocator],
                                                  typing.Sequence[SqIndexPathHashLocator]]:
-        self._fp1.seek(self.index1.path_hash_locator_segment.offset)
-        data = self._fp1.read(self.index1.path_hash_locator_segment.size)
-        return (SqIndexPathHashLocator * (len(data) // ctypes.sizeof(SqIndexPathHashLocator))
-                ).from_buffer_copy(data)
+        return self._read_segment(1, self.index1.path_hash_locator_segment, SqIndexPathHashLocator)
+
+    @functools.cached_property
+    def pair_hash_table(self) -> SqIndexHashTable:
+        return SqIndexHashTable.from_pair_hash_locators(self.pair_hash_locators, self.pair_hash_with_text_locators)
+
+    @functools.cached_property
+    def full_path_hash_table(self) -> SqIndexHashTable:
+        return SqIndexHashTable.from_full_path_hash_locators(self.full_path_hash_locators,
+                                                             self.full_path_hash_with_text_locators)
 
     def name_hash_locators(self, path_hash: int) -> typing.Union[ctypes.Array[SqIndexPairHashLocator],
                                                                  typing.Sequence[SqIndexPairHashLocator]]:
@@ -134,12 +213,45 @@ class SqIndexReader(typing.ContextManager):
         return files1[start_index:to_index]
 
 
+# Key of a decoded entry in an entry cache: (sqpack name, dat index, offset).
+EntryCacheKey = typing.Tuple[str, int, int]
+
+
+class SqpackEntryInfo(typing.NamedTuple):
+    path_spec: SqPathSpec
+    data_index: int
+    offset: int
+    stored_size: int
+    type: typing.Optional[SqDataFileEntryType]
+
+
+class SqpackEntryStat(typing.NamedTuple):
+    path_spec: SqPathSpec
+    data_index: int
+    offset: int
+    stored_size: int
+    type: SqDataFileEntryType
+    decompressed_size: int
+    block_count: int
+    texture_header: typing.Optional[TextureHeader]
+
+
+# Bytes read at once by stat; enough for the entry header of most entries, along with the texture header if any.
+STAT_READ_SIZE = 0x400
+
+
 class SqpackFile:
-    def __init__(self, path_spec: SqPathSpec, fp: typing.BinaryIO, offset: int, read_size: int):
+    def __init__(self, path_spec: SqPathSpec, fp: typing.BinaryIO, offset: int, read_size: int,
+                 executor: typing.Optional[concurrent.futures.Executor] = None,
+                 entry_cache: typing.Optional[LruCache[EntryCacheKey, bytearray]] = None,
+                 entry_cache_key: typing.Optional[EntryCacheKey] = None):
         self._path_spec = path_spec
         self._fp = fp
         self._offset = offset
         self._read_size = read_size
+        self._executor = executor
+        self._entry_cache = entry_cache
+        self._entry_cache_key = entry_cache_key
 
     @property
     def path_spec(self):
@@ -147,29 +259,59 @@ class SqpackFile:
 
     @functools.cached_property
     def data(self) -> bytearray:
-        return decode_entry(self._fp, self._offset, self._read_size)
+        if self._entry_cache is None:
+            return decode_entry(self._fp, self._offset, self._read_size, self._executor)
+
+        # The cached copy is shared; hand out a private one so that callers may keep modifying the result.
+        return bytearray(self._entry_cache.get_or_load(
+            self._entry_cache_key, lambda: decode_entry(self._fp, self._offset, self._read_size, self._executor)))
+
+    def open(self, block_cache_size: int = 4) -> SqpackEntryStream:
+        return SqpackEntryStream(self._fp, self._offset, block_cache_size)
+
+    def read_model_chunks(self, chunks: typing.Iterable[int]) -> bytearray:
+        return decode_model_chunks(self._fp, self._offset, chunks, self._executor)
+
+    def read_texture_mipmaps(self, mipmap_indices: typing.Iterable[int]
+                             ) -> typing.Tuple[bytearray, typing.List[bytearray]]:
+        return decode_texture_mipmaps(self._fp, self._offset, mipmap_indices, self._executor)
 
 
 class SqpackReader:
     index: SqIndexReader
-    _fp_data: typing.List[typing.Union[io.RawIOBase, typing.BinaryIO]]
-
-    def __init__(self, index_path: typing.Union[str, os.PathLike]):
+    _fp_data: typing.List[typing.Union[io.RawIOBase, typing.BinaryIO, PooledFile]]
+
+    def __init__(self, index_path: typing.Union[str, os.PathLike], use_mmap: bool = False,
+                 use_hash_table: bool = False, cache_dir: typing.Union[str, os.PathLike, None] = None,
+                 executor: typing.Optional[concurrent.futures.Executor] = None,
+                 entry_cache: typing.Optional[LruCache[EntryCacheKey, bytearray]] = None,
+                 path_db: typing.Optional[SqPathDatabase] = None,
+                 file_pool: typing.Optional[FilePool] = None):
         self._cleanup = contextlib.ExitStack()
+        self._use_hash_table = use_hash_table
+        self._executor = executor
+        self._entry_cache = entry_cache
+        self._path_db = path_db
         index_path = pathlib.Path(index_path)
 
         self._name = str(index_path.with_suffix("").with_suffix(""))
 
         try:
             self.index = SqIndexReader(index_path.with_suffix(".index"),
-                                       index_path.with_suffix(".index2"))
+                                       index_path.with_suffix(".index2"),
+                                       use_mmap=use_mmap, file_pool=file_pool)
             self._cleanup.enter_context(self.index)
 
+            self._data_paths = [index_path.with_suffix(f".dat{i}")
+                                for i in range(self.index.index1.text_locator_segment.count)]
             self._fp_data = []
-            for i in range(self.index.index1.text_locator_segment.count):
-                path = pathlib.Path(index_path.with_suffix(f".dat{i}"))
-                self._fp_data.append(path.open("rb"))
-                self._cleanup.enter_context(self._fp_data[-1])
+            for path in self._data_paths:
+                # Pooled data files are opened on first read, and may be closed and reopened by the pool as needed.
+                self._fp_data.append(path.open("rb") if file_pool is None else file_pool.get(path))
+                self._cleanup.callback(self._fp_data[-1].close)
+
+            if cache_dir is not None:
+                self._load_locator_cache(pathlib.Path(cache_dir), index_path)
 
         except BaseException:
             self._cleanup.close()
@@ -182,10 +324,105 @@ class SqpackReader:
         self.close()
 
     def close(self):
+        self.invalidate_entry_cache()
         self._cleanup.close()
 
+    @property
+    def entry_cache(self) -> typing.Optional[LruCache[EntryCacheKey, bytearray]]:
+        return self._entry_cache
+
+    def set_executor(self, executor: typing.Optional[concurrent.futures.Executor]):
+        self._executor = executor
+
+    def reopen_data_files(self):
+        # Replaces the data file handles with newly opened ones, so that they no longer share file descriptions with
+        # another process after a fork. SqpackFile and stream objects obtained earlier must not be used afterwards.
+        # Pooled files are left to their pool.
+        for i, fp in enumerate(self._fp_data):
+            if isinstance(fp, PooledFile):
+                continue
+            self._fp_data[i] = self._data_paths[i].open("rb")
+            self._cleanup.callback(self._fp_data[i].close)
+            fp.close()
+
+    def preload(self):
+        # Builds every lookup structure otherwise built on first use.
+        index = self.index
+        for name in ("pair_hash_locators", "full_path_hash_locators", "pair_hash_with_text_locators",
+                     "full_path_hash_with_text_locators", "path_hash_locators"):
+            getattr(index, name)
+        if self._use_hash_table:
+            _ = index.pair_hash_table
+            _ = index.full_path_hash_table
+        _ = self._stored_size_table
+        _ = self._text_locators_by_path
+
+    def invalidate_entry_cache(self) -> int:
+        if self._entry_cache is None:
+            return 0
+        return self._entry_cache.invalidate_if(lambda key: key[0] == self._name)
+
+    def _get_file(self, path_spec: SqPathSpec, locator: SqIndexDataLocator) -> SqpackFile:
+        return SqpackFile(path_spec, self._fp_data[locator.index], locator.offset, self.get_stored_size(locator),
+                          self._executor, self._entry_cache, (self._name, locator.index, locator.offset))
+
+    def _iter_entry_locators(self) -> typing.Iterator[typing.Tuple[SqPathSpec, SqIndexDataLocator]]:
+        # Every entry once, with its full path if the synonym tables or path_db know it. As in _stored_size_table,
+        # entries are told apart by their locator value without the synonym bit. Specs are interned, so that listing
+        # again, or listing other sqpacks sharing paths, does not make another copy of specs still held elsewhere.
+        seen = set()
+        for f in self.index.pair_hash_with_text_locators:
+            if f.name_hash == f.SENTINEL and f.path_hash == f.SENTINEL and f.conflict_index == f.SENTINEL:
+                break
+            if f.locator.value & ~1 not in seen:
+                seen.add(f.locator.value & ~1)
+                yield SqPathSpec(f.full_path).intern(), f.locator
+
+        for f in self.index.full_path_hash_with_text_locators:
+            if f.full_path_hash == f.SENTINEL and f.unused_hash == f.SENTINEL and f.conflict_index == f.SENTINEL:
+                break
+            if f.locator.value & ~1 not in seen:
+                seen.add(f.locator.value & ~1)
+                yield SqPathSpec(f.full_path).intern(), f.locator
+
+        for f in self.index.pair_hash_locators:
+            if not f.locator.synonym and f.locator.value not in seen:
+                seen.add(f.locator.value)
+                path_spec = SqPathSpec(path_hash=f.path_hash, name_hash=f.name_hash).intern()
+                yield (path_spec if self._path_db is None else self._path_db.resolve(path_spec)), f.locator
+
+        for f in self.index.full_path_hash_locators:
+            if not f.locator.synonym and f.locator.value not in seen:
+                seen.add(f.locator.value)
+                path_spec = SqPathSpec(full_path_hash=f.full_path_hash).intern()
+                yield (path_spec if self._path_db is None else self._path_db.resolve(path_spec)), f.locator
+
+    def iter_path_specs(self) -> typing.Iterator[SqPathSpec]:
+        for path_spec, _ in self._iter_entry_locators():
+            yield path_spec
+
+    def iter_entries(self, read_types: bool = True) -> typing.Iterator[SqpackEntryInfo]:
+        # Nothing is decoded; with read_types, only the first bytes of each entry header are read to get its type.
+        header_size = ctypes.sizeof(SqDataFileEntryHeader)
+        for path_spec, locator in self._iter_entry_locators():
+            data_index, offset = locator.index, locator.offset
+            entry_type = None
+            if read_types:
+                header = read_at(self._fp_data[data_index], offset, header_size)
+                if len(header) != header_size:
+                    raise CorruptDataException(f"{path_spec} in {self._name} points past the end of dat{data_index}")
+                entry_type = SqDataFileEntryHeader.from_buffer(header).type
+            yield SqpackEntryInfo(path_spec, data_index, offset, self.get_stored_size(locator), entry_type)
+
+    @property
+    def path_db(self) -> typing.Optional[SqPathDatabase]:
+        return self._path_db
+
     def get_locator(self, item: typing.Union[SqPathSpec, str, bytes, os.PathLike]):
         item = SqPathSpec(item)
+        if self._use_hash_table:
+            return self._get_locator_from_hash_table(item)
+
         if item.has_path_name_hash():
             try:
                 files = self.index.name_hash_locators(item.path_hash)
@@ -250,43 +487,252 @@ class SqpackReader:
 
         raise KeyError(f"path is empty")
 
-    def get_stored_size(self, locator: SqIndexDataLocator):
-        offsets = self._get_data_offsets()[locator.index]
-        next_offset = bisect_left(offsets, locator.offset) + 1
-        fp = self._fp_data[locator.index]
-        if next_offset >= len(offsets):
-            fp.seek(0, os.SEEK_END)
-            next_offset = fp.tell()
-        else:
-            next_offset = offsets[next_offset]
-        return next_offset - locator.offset
+    def _get_hash_table_key(self, item: SqPathSpec) -> typing.Tuple[SqIndexHashTable, int]:
+        if item.has_path_name_hash():
+            return self.index.pair_hash_table, pair_hash_key(item.path_hash, item.name_hash)
+        if item.has_full_path_hash():
+            return self.index.full_path_hash_table, item.full_path_hash
+        raise KeyError(f"path is empty")
 
-    @functools.cache
-    def _get_data_offsets(self):
-        res = [[] for _ in range(self.index.index1.text_locator_segment.count)]
-        for f in self.index.pair_hash_locators:
-            res[f.locator.index].append(f.locator.offset)
-        return [sorted(x) for x in res]
+    def _get_locator_from_hash_table(self, item: SqPathSpec) -> SqIndexDataLocator:
+        table, key = self._get_hash_table_key(item)
+        value = table.get(key)
+        if value is None:
+            raise KeyError(f"{item} not found in {self._name}")
+
+        if value & 1:
+            if not item.has_full_path():
+                raise KeyError(f"{item} found in {self._name}, but is ambiguous")
+            value = table.get_synonym(key, item.full_path)
+            if value is None:
+                raise KeyError(f"{item} not found in {self._name} (not in synonym table)")
+
+        return SqIndexDataLocator(value)
+
+    def get_locators(self, items: typing.Iterable[typing.Union[SqPathSpec, str, bytes, os.PathLike]]
+                     ) -> typing.List[typing.Optional[SqIndexDataLocator]]:
+        pair_table = self.index.pair_hash_table
+        full_table = self.index.full_path_hash_table
+        result = []
+        for item in items:
+            item = SqPathSpec(item)
+            if item.has_path_name_hash():
+                table, key = pair_table, pair_hash_key(item.path_hash, item.name_hash)
+            elif item.has_full_path_hash():
+                table, key = full_table, item.full_path_hash
+            else:
+                result.append(None)
+                continue
+
+            value = table.get(key)
+            if value is not None and value & 1:
+                value = table.get_synonym(key, item.full_path) if item.has_full_path() else None
+            result.append(None if value is None else SqIndexDataLocator(value))
+        return result
+
+    def __contains__(self, item: typing.Union[SqPathSpec, str, bytes, os.PathLike]) -> bool:
+        try:
+            self._get_locator_from_hash_table(SqPathSpec(item))
+            return True
+        except KeyError:
+            return False
+
+    def _load_locator_cache(self, cache_dir: pathlib.Path, index_path: pathlib.Path):
+        key = get_locator_cache_key(self.index, self._data_sizes)
+        name = f"{index_path.parent.name}.{index_path.name.split('.', 1)[0]}.{get_location_tag(index_path.parent)}"
+        cache_path = cache_dir / f"{name}.{key.hex()}.locators"
+        try:
+            cache = SqLocatorCache(cache_path, key)
+        except (OSError, ValueError, CorruptDataException):
+            try:
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                SqLocatorCache.write(cache_path, key, self._build_locator_cache_sections())
+                cache = SqLocatorCache(cache_path, key)
+            except OSError:
+                return
+            # Caches made for earlier versions of the same index file, at the same location, are of no further use.
+            remove_stale_files(cache_path, f"{name}.{'?' * len(key.hex())}.locators")
+        self._cleanup.callback(cache.close)
+
+        self.index.pair_hash_table = SqIndexHashTable(
+            cache["pair_hash_keys"], cache["pair_hash_values"],
+            pair_hash_synonyms(self.index.pair_hash_with_text_locators))
+        self.index.full_path_hash_table = SqIndexHashTable(
+            cache["full_path_hash_keys"], cache["full_path_hash_values"],
+            full_path_hash_synonyms(self.index.full_path_hash_with_text_locators))
+
+        self._stored_size_table = cache["stored_size_locators"], cache["stored_sizes"]
+
+    def _build_locator_cache_sections(self) -> typing.Dict[str, typing.Sequence[int]]:
+        pair_hash_table = self.index.pair_hash_table
+        full_path_hash_table = self.index.full_path_hash_table
+        stored_size_locators, stored_sizes = self._stored_size_table
+        return {
+            "pair_hash_keys": array.array("Q", pair_hash_table.keys),
+            "pair_hash_values": array.array("I", pair_hash_table.values),
+            "full_path_hash_keys": array.array("Q", full_path_hash_table.keys),
+            "full_path_hash_values": array.array("I", full_path_hash_table.values),
+            "stored_size_locators": array.array("I", stored_size_locators),
+            "stored_sizes": array.array("Q", stored_sizes),
+        }
+
+    def get_stored_size(self, locator: SqIndexDataLocator) -> int:
+        value = locator.value & ~1
+        locators, stored_sizes = self._stored_size_table
+        i = bisect_left(locators, _stored_size_order(value), key=_stored_size_order)
+        if i == len(locators) or locators[i] != value:
+            raise KeyError(f"{locator} not found in {self._name}")
+        return stored_sizes[i]
+
+    @functools.cached_property
+    def _data_sizes(self) -> typing.List[int]:
+        return [path.stat().st_size for path in self._data_paths]
+
+    @functools.cached_property
+    def _stored_size_table(self) -> typing.Tuple[typing.Sequence[int], typing.Sequence[int]]:
+        # Locator values of every entry in either index file, without the synonym bit, sorted by dat index and offset,
+        # and the number of bytes from each entry to the next one or to the end of its dat file.
+        locators = set(value for value in as_uint32_words(self.index.pair_hash_locators)[2::4] if not value & 1)
+        locators.update(value for value in as_uint32_words(self.index.full_path_hash_locators)[1::2] if not value & 1)
+        for f in self.index.pair_hash_with_text_locators:
+            if f.name_hash == f.SENTINEL and f.path_hash == f.SENTINEL and f.conflict_index == f.SENTINEL:
+                break
+            locators.add(f.locator.value & ~1)
+        for f in self.index.full_path_hash_with_text_locators:
+            if f.full_path_hash == f.SENTINEL and f.unused_hash == f.SENTINEL and f.conflict_index == f.SENTINEL:
+                break
+            locators.add(f.locator.value & ~1)
+
+        locators = array.array("I", sorted(locators, key=_stored_size_order))
+        stored_sizes = array.array("Q", bytes(8 * len(locators)))
+        data_sizes = self._data_sizes
+        for i, value in enumerate(locators):
+            if i + 1 < len(locators) and (locators[i + 1] & 0xE) == (value & 0xE):
+                stored_sizes[i] = (locators[i + 1] - value) << 3
+            else:
+                stored_sizes[i] = data_sizes[(value & 0xE) >> 1] - ((value & 0xFFFFFFF0) << 3)
+        return locators, stored_sizes
 
     def __getitem__(self, item: typing.Union[SqPathSpec, str, bytes, os.PathLike]):
         item = SqPathSpec(item)
 
         if item.has_full_path() and item.full_path[-1] == '/':
-            result = []
-            for f in self.index.name_hash_locators(item.path_hash):
+            return self.list_directory(item)
+
+        return self._get_file(item, self.get_locator(item))
+
+    @functools.cached_property
+    def _text_locators_by_path(self) -> typing.Tuple[typing.List[str],
+                                                     typing.List[typing.Tuple[SqPathSpec, SqIndexDataLocator]]]:
+        # Entries of the synonym table, sorted by lowercase full path, for prefix queries by bisection.
+        entries = []
+        for f in self.index.pair_hash_with_text_locators:
+            if f.name_hash == f.SENTINEL and f.path_hash == f.SENTINEL and f.conflict_index == f.SENTINEL:
+                break
+            entries.append((f.full_path.lower(), f.path_spec.intern(), SqIndexDataLocator(f.locator.value)))
+        entries.sort(key=lambda x: x[0])
+        return [x[0] for x in entries], [(x[1], x[2]) for x in entries]
+
+    def list_directory(self, item: typing.Union[SqPathSpec, str, bytes, os.PathLike]) -> typing.List[SqpackFile]:
+        # Files directly in the folder, and files in the synonym table under the folder and its subfolders.
+        # Costs a bisection each into the folder and synonym tables, and then time proportional to the result.
+        item = SqPathSpec(item)
+        if item.has_full_path() and not item.full_path.endswith("/"):
+            item = SqPathSpec(item.full_path + "/")
+        result = []
+        try:
+            folder_files = self.index.name_hash_locators(item.path_hash)
+        except KeyError:
+            folder_files = None
+        else:
+            for f in folder_files:
                 if not f.locator.synonym:
-                    result.append(SqpackFile(SqPathSpec(path_hash=f.path_hash, name_hash=f.name_hash),
-                                             self._fp_data[f.locator.index], f.locator.offset,
-                                             self.get_stored_size(f.locator)))
-            for f in self.index.pair_hash_with_text_locators:
-                if f.name_hash == f.SENTINEL and f.path_hash == f.SENTINEL and f.conflict_index == f.SENTINEL:
+                    path_spec = SqPathSpec(path_hash=f.path_hash, name_hash=f.name_hash).intern()
+                    if self._path_db is not None:
+                        path_spec = self._path_db.resolve(path_spec)
+                    result.append(self._get_file(path_spec, f.locator))
+
+        if item.has_full_path():
+            prefix = item.full_path.lower()
+            text_paths, text_entries = self._text_locators_by_path
+            for i in range(bisect_left(text_paths, prefix), len(text_paths)):
+                if not text_paths[i].startswith(prefix):
                     break
-                path_spec = f.path_spec
-                if path_spec.full_path.lower().startswith(item.full_path):
-                    result.append(SqpackFile(path_spec,
-                                             self._fp_data[f.locator.index], f.locator.offset,
-                                             self.get_stored_size(f.locator)))
-            return result
+                result.append(self._get_file(*text_entries[i]))
 
+        if folder_files is None and not result:
+            raise KeyError(f"{item} not found in {self._name} (path was not found)")
+        return result
+
+    def stat(self, item: typing.Union[SqPathSpec, str, bytes, os.PathLike]) -> SqpackEntryStat:
+        item = SqPathSpec(item)
         locator = self.get_locator(item)
-        return SqpackFile(item, self._fp_data[locator.index], locator.offset, self.get_stored_size(locator))
+        return self._stat(item, locator.index, locator.offset, self.get_stored_size(locator))
+
+    def stat_many(self, items: typing.Iterable[typing.Union[SqPathSpec, str, bytes, os.PathLike]]
+                  ) -> typing.Iterator[SqpackEntryStat]:
+        # Yields in the order of dat index and offset.
+        requests = []
+        for item in items:
+            item = SqPathSpec(item)
+            locator = self.get_locator(item)
+            requests.append((locator.index, locator.offset, self.get_stored_size(locator), item))
+        requests.sort(key=lambda x: (x[0], x[1]))
+        for data_index, offset, stored_size, item in requests:
+            yield self._stat(item, data_index, offset, stored_size)
+
+    def _stat(self, item: SqPathSpec, data_index: int, offset: int, stored_size: int) -> SqpackEntryStat:
+        fp = self._fp_data[data_index]
+        data = read_at(fp, offset, max(ctypes.sizeof(SqDataFileEntryHeader), min(stored_size, STAT_READ_SIZE)))
+        if len(data) < ctypes.sizeof(SqDataFileEntryHeader):
+            raise CorruptDataException(f"{item} in {self._name} points past the end of dat{data_index}")
+
+        header = SqDataFileEntryHeader.from_buffer_copy(data)
+        required_size = header.header_size
+        if header.type == SqDataFileEntryType.Texture:
+            required_size += ctypes.sizeof(TextureHeader)
+        if len(data) < required_size:
+            data = read_at(fp, offset, required_size)
+            if len(data) < required_size:
+                raise CorruptDataException(f"{item} in {self._name} is truncated")
+
+        texture_header = None
+        if header.type == SqDataFileEntryType.Texture:
+            texture_header = TextureHeader.from_buffer_copy(data, header.header_size)
+        return SqpackEntryStat(item, data_index, offset, stored_size, header.type, header.decompressed_size,
+                               get_entry_block_count(header, data), texture_header)
+
+    def read_many(self, items: typing.Iterable[typing.Union[SqPathSpec, str, bytes, os.PathLike]],
+                  max_read_size: int = 0x1000000) -> typing.Iterator[typing.Tuple[SqPathSpec, bytearray]]:
+        requests = []
+        for item in items:
+            item = SqPathSpec(item)
+            locator = self.get_locator(item)
+            if self._entry_cache is not None:
+                data = self._entry_cache.get((self._name, locator.index, locator.offset))
+                if data is not None:
+                    yield item, bytearray(data)
+                    continue
+            requests.append((locator.index, locator.offset, self.get_stored_size(locator), item))
+        requests.sort(key=lambda x: (x[0], x[1]))
+
+        i = 0
+        while i < len(requests):
+            data_index, read_from, stored_size, _ = requests[i]
+            read_to = read_from + stored_size
+            j = i + 1
+            while j < len(requests) and requests[j][0] == data_index and requests[j][1] <= read_to:
+                next_to = requests[j][1] + requests[j][2]
+                if next_to - read_from > max_read_size and next_to > read_to:
+                    break
+                read_to = max(read_to, next_to)
+                j += 1
+
+            view = memoryview(read_at(self._fp_data[data_index], read_from, read_to - read_from))
+            for _, offset, stored_size, item in requests[i:j]:
+                data = decode_entry_data(view[offset - read_from:offset - read_from + stored_size], self._executor)
+                if self._entry_cache is not None:
+                    self._entry_cache.put((self._name, data_index, offset), data)
+                    data = bytearray(data)
+                yield item, data
+            i = j
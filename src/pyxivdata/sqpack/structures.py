@@ -448,6 +448,27 @@ class SqDataTextureBlockHeaderLocator(ctypes.LittleEndianStructure):
     sub_block_count: int
 
 
+class SqDataModelChunk(enum.IntEnum):
+    # Indices into SqDataModelBlockLocatorChunkInfo16/32.
+    Stack = 0
+    Runtime = 1
+    Vertex0 = 2
+    EdgeGeometryVertex0 = 3
+    Index0 = 4
+    Vertex1 = 5
+    EdgeGeometryVertex1 = 6
+    Index1 = 7
+    Vertex2 = 8
+    EdgeGeometryVertex2 = 9
+    Index2 = 10
+
+    @classmethod
+    def for_lod(cls, lod: int, edge_geometry: bool = False) -> typing.List['SqDataModelChunk']:
+        if edge_geometry:
+            return [cls(2 + lod * 3), cls(3 + lod * 3), cls(4 + lod * 3)]
+        return [cls(2 + lod * 3), cls(4 + lod * 3)]
+
+
 class SqDataModelBlockLocatorChunkInfo32(ctypes.LittleEndianStructure):
     _fields_ = (
         ("stack", ctypes.c_uint32),
@@ -0,0 +1,19 @@
+import os
+import weakref
+
+# Objects whose _after_fork_in_child method is called in the child process right after os.fork; mostly for replacing
+# locks that another thread of the parent may have been holding at the time of forking.
+_objects: "weakref.WeakSet" = weakref.WeakSet()
+
+
+def register_after_fork_in_child(obj):
+    _objects.add(obj)
+
+
+def _after_fork_in_child():
+    for obj in list(_objects):
+        obj._after_fork_in_child()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,148 @@
+import collections
+import contextlib
+import dataclasses
+import os
+import pathlib
+import threading
+import typing
+
+from pyxivdata.util.after_fork import register_after_fork_in_child
+
+
+@dataclasses.dataclass
+class FilePoolStats:
+    hits: int = 0
+    opens: int = 0
+    evictions: int = 0
+    open_files: int = 0
+    leased_files: int = 0
+
+
+class _PoolEntry:
+    __slots__ = ("fp", "leases", "discarded")
+
+    def __init__(self, fp: typing.BinaryIO):
+        self.fp = fp
+        self.leases = 0
+        self.discarded = False
+
+
+class FilePool:
+    # Keeps at most max_open read-only files open, closing the least recently used one that is not leased out when
+    # another has to be opened. A file being read from is never closed under the reader; if every open file is
+    # leased, the pool temporarily goes over max_open. All operations are thread-safe.
+
+    def __init__(self, max_open: int = 64):
+        self._max_open = max_open
+        self._files: typing.OrderedDict[pathlib.Path, _PoolEntry] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = FilePoolStats()
+        register_after_fork_in_child(self)
+
+    def _after_fork_in_child(self):
+        # Leases held by threads of the parent will never end here; forget them, and let the child open its own
+        # files as needed rather than sharing file descriptions with the parent.
+        self._lock = threading.Lock()
+        for entry in self._files.values():
+            entry.fp.close()
+        self._files.clear()
+        self._stats.open_files = self._stats.leased_files = 0
+
+    @property
+    def max_open(self) -> int:
+        return self._max_open
+
+    @max_open.setter
+    def max_open(self, value: int):
+        with self._lock:
+            self._max_open = value
+            self._evict()
+
+    @property
+    def stats(self) -> FilePoolStats:
+        with self._lock:
+            return dataclasses.replace(self._stats)
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.hits = self._stats.opens = self._stats.evictions = 0
+
+    def __len__(self):
+        return len(self._files)
+
+    def get(self, path: typing.Union[str, os.PathLike]) -> 'PooledFile':
+        return PooledFile(self, pathlib.Path(path))
+
+    @contextlib.contextmanager
+    def lease(self, path: pathlib.Path) -> typing.Iterator[typing.BinaryIO]:
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is not None:
+                self._files.move_to_end(path)
+                self._stats.hits += 1
+            else:
+                entry = self._files[path] = _PoolEntry(path.open("rb"))
+                self._stats.opens += 1
+            entry.leases += 1
+            self._stats.leased_files += entry.leases == 1
+            self._evict()
+
+        try:
+            yield entry.fp
+        finally:
+            with self._lock:
+                entry.leases -= 1
+                self._stats.leased_files -= entry.leases == 0
+                if entry.discarded and not entry.leases:
+                    entry.fp.close()
+                else:
+                    self._evict()
+
+    def discard(self, path: typing.Union[str, os.PathLike]):
+        # Closes the file now, or once the last lease on it ends.
+        with self._lock:
+            entry = self._files.pop(pathlib.Path(path), None)
+            if entry is None:
+                return
+            self._stats.open_files = len(self._files)
+            if entry.leases:
+                entry.discarded = True
+            else:
+                entry.fp.close()
+
+    def close(self):
+        with self._lock:
+            for path in list(self._files):
+                entry = self._files.pop(path)
+                if entry.leases:
+                    entry.discarded = True
+                else:
+                    entry.fp.close()
+            self._stats.open_files = 0
+
+    def _evict(self):
+        if len(self._files) > self._max_open:
+            for path in [path for path, entry in self._files.items() if not entry.leases]:
+                if len(self._files) <= self._max_open:
+                    break
+                self._files.pop(path).fp.close()
+                self._stats.evictions += 1
+        self._stats.open_files = len(self._files)
+
+
+class PooledFile:
+    # Stands in for an open file of a FilePool; read_at leases the actual file for each read.
+
+    def __init__(self, pool: FilePool, path: pathlib.Path):
+        self._pool = pool
+        self._path = path
+
+    @property
+    def path(self) -> pathlib.Path:
+        return self._path
+
+    def lease(self) -> typing.ContextManager[typing.BinaryIO]:
+        return self._pool.lease(self._path)
+
+    def close(self):
+        self._pool.discard(self._path)
@@ -0,0 +1,124 @@
+import collections
+import dataclasses
+import threading
+import typing
+
+from pyxivdata.util.after_fork import register_after_fork_in_child
+
+_K = typing.TypeVar("_K")
+_V = typing.TypeVar("_V")
+
+
+@dataclasses.dataclass
+class LruCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    size: int = 0
+
+
+class LruCache(typing.Generic[_K, _V]):
+    # Least recently used cache bounded by the total size of the stored values rather than by their count.
+    # All operations are thread-safe; loaders passed to get_or_load run without holding the lock.
+
+    def __init__(self, max_size: int, sizeof: typing.Callable[[_V], int] = len):
+        self._max_size = max_size
+        self._sizeof = sizeof
+        self._items: typing.OrderedDict[_K, typing.Tuple[_V, int]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = LruCacheStats()
+        register_after_fork_in_child(self)
+
+    def _after_fork_in_child(self):
+        self._lock = threading.Lock()
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, value: int):
+        with self._lock:
+            self._max_size = value
+            self._evict()
+
+    @property
+    def stats(self) -> LruCacheStats:
+        with self._lock:
+            return dataclasses.replace(self._stats)
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.hits = self._stats.misses = self._stats.evictions = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key: _K) -> bool:
+        return key in self._items
+
+    def get(self, key: _K, default: typing.Optional[_V] = None) -> typing.Optional[_V]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self._stats.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self._stats.hits += 1
+            return item[0]
+
+    def get_or_load(self, key: _K, loader: typing.Callable[[], _V]) -> _V:
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+                self._stats.hits += 1
+                return item[0]
+            self._stats.misses += 1
+
+        value = loader()
+        self.put(key, value)
+        return value
+
+    def put(self, key: _K, value: _V):
+        size = self._sizeof(value)
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self._stats.size -= previous[1]
+            if size > self._max_size:
+                self._stats.entries = len(self._items)
+                return
+            self._items[key] = value, size
+            self._stats.size += size
+            self._evict()
+
+    def invalidate(self, key: _K) -> bool:
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return False
+            self._stats.size -= item[1]
+            self._stats.entries = len(self._items)
+            return True
+
+    def invalidate_if(self, predicate: typing.Callable[[_K], bool]) -> int:
+        with self._lock:
+            keys = [key for key in self._items if predicate(key)]
+            for key in keys:
+                self._stats.size -= self._items.pop(key)[1]
+            self._stats.entries = len(self._items)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._stats.size = self._stats.entries = 0
+
+    def _evict(self):
+        while self._stats.size > self._max_size:
+            _, (_, size) = self._items.popitem(last=False)
+            self._stats.size -= size
+            self._stats.evictions += 1
+        self._stats.entries = len(self._items)
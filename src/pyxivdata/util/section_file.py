@@ -0,0 +1,156 @@
+import ctypes
+import hashlib
+import mmap
+import os
+import pathlib
+import struct
+import typing
+
+from pyxivdata.common import CorruptDataException
+
+
+class SectionFileHeader(ctypes.LittleEndianStructure):
+    _fields_ = (
+        ("signature", ctypes.c_char * 8),
+        ("version", ctypes.c_uint32),
+        ("section_count", ctypes.c_uint32),
+        ("key", ctypes.c_uint8 * 20),
+        ("padding_0x024", ctypes.c_uint8 * 4),
+    )
+
+    signature: bytes
+    version: int
+    section_count: int
+    key: bytearray
+    padding_0x024: bytearray
+
+
+class SectionFileSection(ctypes.LittleEndianStructure):
+    _fields_ = (
+        ("name", ctypes.c_char * 24),
+        ("format", ctypes.c_char * 8),
+        ("offset", ctypes.c_uint64),
+        ("count", ctypes.c_uint64),
+    )
+
+    name: bytes
+    format: bytes
+    offset: int
+    count: int
+
+
+class SectionFile:
+    # A read-only memory mapped file made of named arrays, each exposed as a memoryview cast to its struct format.
+    # Arrays are stored in the byte order of the machine that wrote the file; subclasses set SIGNATURE and VERSION.
+    SIGNATURE: typing.ClassVar[bytes]
+    VERSION: typing.ClassVar[int]
+
+    _mmap: typing.Optional[mmap.mmap] = None
+
+    def __init__(self, path: typing.Union[str, os.PathLike], key: typing.Optional[bytes] = None):
+        self._path = pathlib.Path(path)
+        with self._path.open("rb") as fp:
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            view = memoryview(self._mmap)
+            header = SectionFileHeader.from_buffer_copy(view[:ctypes.sizeof(SectionFileHeader)])
+            if header.signature != self.SIGNATURE:
+                raise CorruptDataException(f"{type(self).__name__}.signature mismatch")
+            if header.version != self.VERSION:
+                raise CorruptDataException(f"{type(self).__name__}.version mismatch")
+            if key is not None and bytes(header.key) != key:
+                raise CorruptDataException(f"{type(self).__name__}.key mismatch")
+            self._key = bytes(header.key)
+
+            sections = (SectionFileSection * header.section_count).from_buffer_copy(
+                view[ctypes.sizeof(header):ctypes.sizeof(header) + header.section_count * ctypes.sizeof(
+                    SectionFileSection)])
+
+            self._sections: typing.Dict[str, memoryview] = {}
+            for section in sections:
+                fmt = section.format.decode("ascii")
+                size = section.count * struct.calcsize(fmt)
+                if section.offset + size > len(view):
+                    raise CorruptDataException(f"{type(self).__name__} section {section.name} is truncated")
+                self._sections[section.name.decode("utf-8")] = view[section.offset:section.offset + size].cast(fmt)
+
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        self._sections = {}
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
+
+    @property
+    def path(self) -> pathlib.Path:
+        return self._path
+
+    @property
+    def key(self) -> bytes:
+        return self._key
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._sections
+
+    def __getitem__(self, name: str) -> memoryview:
+        return self._sections[name]
+
+    @classmethod
+    def write(cls, path: typing.Union[str, os.PathLike], key: bytes,
+              sections: typing.Dict[str, typing.Union[typing.Sequence[int], memoryview]]):
+        path = pathlib.Path(path)
+        header = SectionFileHeader()
+        header.signature = cls.SIGNATURE
+        header.version = cls.VERSION
+        header.section_count = len(sections)
+        header.key[:] = key
+
+        descriptors = (SectionFileSection * len(sections))()
+        blobs = []
+        offset = ctypes.sizeof(header) + ctypes.sizeof(descriptors)
+        for descriptor, (name, data) in zip(descriptors, sections.items()):
+            data = memoryview(data)
+            offset = (offset + 7) & ~7
+            descriptor.name = name.encode("utf-8")
+            descriptor.format = data.format.encode("ascii")
+            descriptor.offset = offset
+            descriptor.count = len(data)
+            blobs.append((offset, data))
+            offset += data.nbytes
+
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            with temp_path.open("wb") as fp:
+                fp.write(header)
+                fp.write(descriptors)
+                for offset, data in blobs:
+                    fp.write(bytes(offset - fp.tell()))
+                    fp.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+
+
+def get_location_tag(path: pathlib.Path) -> str:
+    # Identifies the resolved location of path, for naming cache files of several installations sharing a directory.
+    return hashlib.sha1(str(path.resolve()).encode("utf-8")).hexdigest()[:16]
+
+
+def remove_stale_files(path: pathlib.Path, pattern: str):
+    # Deletes the files in the directory of path matching pattern, other than path itself; for caches whose key is part
+    # of their file name. pattern must only match files made from the same source as path, which is what the location
+    # tag in cache file names is for. Files still in use elsewhere may fail to be deleted, and are left alone.
+    for stale_path in path.parent.glob(pattern):
+        if stale_path.name != path.name:
+            try:
+                stale_path.unlink()
+            except OSError:
+                pass